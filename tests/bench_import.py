@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Benchmark importing a synthetic Tasking Manager database into TM Admin.
+This creates fake TM tables in a scratch database, and then imports them
+with both INSERT and COPY so the rows/sec can be compared. The TM Admin
+database must already have the tables created by tmadmin-manage.
+"""
+
+import argparse
+import logging
+import sys
+import os
+import time
+import asyncio
+from tm_admin.tmdb import TMImport
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+# These only use the columns that exist in both schemas, the data is fake.
+synthetic = {"users": """
+DROP TABLE IF EXISTS users;
+CREATE TABLE users (id bigint, username character varying,
+    name character varying, city character varying, role int,
+    mapping_level int, tasks_mapped int, is_expert boolean,
+    date_registered timestamp without time zone, projects_mapped int[]);
+INSERT INTO users SELECT i, 'user' || i, 'User ' || i, 'Someplace', 0,
+    (i % 3) + 1, i % 100, i % 2 = 0, now() - (i || ' minutes')::interval,
+    ARRAY[i % 50, i % 70] FROM generate_series(1, {records}) AS i
+""",
+             "tasks": """
+CREATE EXTENSION IF NOT EXISTS postgis;
+DROP TABLE IF EXISTS tasks;
+CREATE TABLE tasks (id bigint, project_id int, x int, y int, zoom int,
+    geometry geometry(MultiPolygon, 4326), task_status int,
+    is_square boolean, mapped_by bigint);
+INSERT INTO tasks SELECT i % 1000, (i / 1000) + 1, i % 512, i / 512, 18,
+    ST_Multi(ST_MakeEnvelope((i % 512) * 0.01, (i / 512) * 0.01,
+    (i % 512) * 0.01 + 0.01, (i / 512) * 0.01 + 0.01, 4326)),
+    (i % 10) + 1, true, i % 5000 FROM generate_series(1, {records}) AS i
+""",
+             }
+
+async def benchmark(tmi: TMImport,
+                    table: str,
+                    insert: bool,
+                    ):
+    """
+    Import a synthetic table and return the rows/sec.
+
+    Args:
+        tmi (TMImport): An instantiation of the class that imports data
+        table (str): The table to import
+        insert (bool): Use INSERT instead of COPY
+
+    Returns:
+        (float): The rows imported per second
+    """
+    await tmi.admindb.execute(f"TRUNCATE {table}")
+    await tmi.loadConfig(table)
+    start = time.perf_counter()
+    await tmi.importDB(table, insert)
+    elapsed = time.perf_counter() - start
+    result = await tmi.admindb.execute(f"SELECT count(*) AS count FROM {table}")
+    rows = result[0]['count']
+    return rows / elapsed
+
+async def main():
+    """This main function lets this class be run standalone by a bash script."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    parser.add_argument("-i", "--inuri", default='localhost/tm_bench',
+                        help="The scratch database for the synthetic TM data")
+    parser.add_argument("-o", "--outuri", default='localhost/tm_admin',
+                        help="The URI string for the TM Admin database")
+    parser.add_argument("-t", "--table", default='users', choices=synthetic.keys(),
+                        help="The table to benchmark")
+    parser.add_argument("-r", "--records", type=int, default=100000,
+                        help="The number of synthetic records")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    tmi = TMImport()
+    await tmi.connect(args.inuri, args.outuri)
+
+    log.info(f"Creating {args.records} synthetic records in {args.table}")
+    await tmi.tmdb.execute(synthetic[args.table].format(records=args.records))
+
+    before = await benchmark(tmi, args.table, True)
+    after = await benchmark(tmi, args.table, False)
+    print(f"{args.table}: {args.records} records")
+    print(f"\tINSERT: {before:.0f} rows/sec")
+    print(f"\tCOPY:   {after:.0f} rows/sec ({after / before:.1f}x)")
+
+if __name__ == "__main__":
+    """This is just a hook so this file can be run standalone during development."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main())
@@ -22,6 +22,7 @@ import logging
 import os
 import argparse
 import sys
+from tm_admin.dbsupport import partition
 
 # import tm_admin as tma
 # rootdir = tma.__path__[0]
@@ -33,6 +34,25 @@ log = logging.getLogger(__name__)
 #     """Placeholder to allow CI to pass."""
 #     assert True
 
+def test_partition():
+    # Several history entries for each task, keyed by project and task
+    rows = [(f"entry {index}", index % 7, index % 3) for index in range(0, 100)]
+    parts = partition(rows, (1, 2), 4)
+    assert len(parts) == 4
+    assert sorted([row for part in parts for row in part]) == sorted(rows)
+    # Each task only goes to one worker
+    owners = dict()
+    for worker, part in enumerate(parts):
+        for row in part:
+            assert owners.setdefault((row[1], row[2]), worker) == worker
+    # The rows for a worker stay in order
+    for part in parts:
+        assert part == sorted(part, key=lambda row: int(row[0][6:]))
+
+    # By default the key is the last column
+    parts = partition([("a", 1), ("b", 2), ("c", 1)], (-1,), 2)
+    assert [row for part in parts for row in part if row[1] == 1] == [("a", 1), ("c", 1)]
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
@@ -51,3 +71,6 @@ if __name__ == "__main__":
         
     # test_dummy()
     log.debug("foo")
+
+    print("--- test_partition() ---")
+    test_partition()
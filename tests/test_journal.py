@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test the journal used to resume an import
+"""
+
+import argparse
+import logging
+import sys
+import os
+from tm_admin.journal import coalesce, skipFilter, getKeys
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+def test_coalesce():
+    # Batches finish out of order, and the one after 300 never did
+    ranges = [([200], [300]), (None, [100]), ([400], [500]), ([100], [200])]
+    assert coalesce(ranges) == [(None, [300]), ([400], [500])]
+    assert coalesce([]) == []
+
+def test_filter():
+    assert skipFilter(['id'], []) == ""
+    sql = skipFilter(['id'], [(None, [300]), ([400], [500])])
+    assert sql == "NOT (id) <= (300) AND NOT ((id) > (400) AND (id) <= (500))"
+
+    keys = getKeys('tasks')
+    assert keys == ['project_id', 'id']
+    sql = skipFilter(keys, [([1, 20], [2, 5])])
+    assert sql == "NOT ((project_id, id) > (1, 20) AND (project_id, id) <= (2, 5))"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    print("--- test_coalesce() ---")
+    test_coalesce()
+
+    print("--- test_filter() ---")
+    test_filter()
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test that the merges that aggregate the aux tables get the same results
+as appending the rows one at a time.
+"""
+
+import argparse
+import logging
+import sys
+import os
+import asyncio
+from osm_rawdata.pgasync import PostgresClient
+from tm_admin.campaigns.campaigns import CampaignsDB
+from tm_admin.organizations.organizations import OrganizationsDB
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+# FIXME: For now these tests assume you have a local postgres installed.
+# One has the TM database, the other for tm_admin.
+
+# The TM table, the TM Admin table and array column it's merged into,
+# and the columns of the TM table for the key and the value.
+arrays = {
+    'campaign_projects': ('campaigns', 'projects', 'campaign_id', 'project_id'),
+    'campaign_organisations': ('campaigns', 'organizations', 'campaign_id', 'organisation_id'),
+    'organisation_managers': ('organizations', 'managers', 'organisation_id', 'user_id'),
+}
+
+async def merge_rows(inpg: PostgresClient,
+                     outpg: PostgresClient,
+                     table: str,
+                     ):
+    """Merge a table one row at a time, like it used to be done, and
+    then roll it back so it doesn't change the database."""
+    target, column, key, value = arrays[table]
+    result = await inpg.pg.fetch(f"SELECT {key}, {value} FROM {table} ORDER BY {key}")
+    transaction = outpg.pg.transaction()
+    await transaction.start()
+    await outpg.pg.execute(f"UPDATE {target} SET {column} = NULL")
+    for record in result:
+        sql = f"UPDATE {target} SET {column} = {column}||$1::int WHERE id = $2"
+        await outpg.pg.execute(sql, record[value], record[key])
+    data = await outpg.pg.fetch(f"SELECT id, {column} FROM {target} WHERE {column} IS NOT NULL")
+    await transaction.rollback()
+
+    return {record['id']: sorted(record[column]) for record in data}
+
+async def get_arrays(outpg: PostgresClient,
+                     table: str,
+                     ):
+    target, column, key, value = arrays[table]
+    data = await outpg.pg.fetch(f"SELECT id, {column} FROM {target} WHERE {column} IS NOT NULL")
+
+    return {record['id']: list(record[column]) for record in data}
+
+async def merge_campaigns(inpg: PostgresClient,
+                          outuri: str,
+                          ):
+    log.debug("--- merge_campaigns() ---")
+    campaigns = CampaignsDB()
+    await campaigns.connect(outuri)
+    await campaigns.connectPool(outuri)
+
+    expected = await merge_rows(inpg, campaigns.pg, 'campaign_projects')
+    await campaigns.mergeProjects(inpg)
+    result = await get_arrays(campaigns.pg, 'campaign_projects')
+    # A stale array that didn't get replaced would be an extra key
+    assert set(result) == set(expected)
+    for id, projects in expected.items():
+        assert result[id] == projects
+
+    expected = await merge_rows(inpg, campaigns.pg, 'campaign_organisations')
+    await campaigns.mergeOrganizations(inpg)
+    result = await get_arrays(campaigns.pg, 'campaign_organisations')
+    # A stale array that didn't get replaced would be an extra key
+    assert set(result) == set(expected)
+    for id, organizations in expected.items():
+        assert result[id] == organizations
+
+async def merge_organizations(inpg: PostgresClient,
+                              outuri: str,
+                              ):
+    log.debug("--- merge_organizations() ---")
+    organizations = OrganizationsDB()
+    await organizations.connect(outuri)
+    await organizations.connectPool(outuri)
+
+    expected = await merge_rows(inpg, organizations.pg, 'organisation_managers')
+    await organizations.mergeManagers(inpg)
+    result = await get_arrays(organizations.pg, 'organisation_managers')
+    # A stale array that didn't get replaced would be an extra key
+    assert set(result) == set(expected)
+    for id, managers in expected.items():
+        assert result[id] == managers
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    parser.add_argument("-i", "--inuri", default='localhost/tm4', help="TM Database URI")
+    parser.add_argument("-u", "--uri", default='localhost/testdata', help="Database URI")
+    args = parser.parse_args()
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    inpg = PostgresClient()
+    await inpg.connect(args.inuri)
+
+    await merge_campaigns(inpg, args.uri)
+    await merge_organizations(inpg, args.uri)
+
+if __name__ == "__main__":
+    """This is just a hook so this file can be run standalone during development."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test keeping track of the progress of the tables
+"""
+
+import argparse
+import logging
+import sys
+import os
+import json
+import tempfile
+from tm_admin.metrics import Progress, Counter
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+def test_counter():
+    counter = Counter("import:users", 1000)
+    counter.read += 500
+    counter.written += 250
+    assert counter.rate() > 0.0
+    assert counter.eta() is not None
+    assert "wrote 250 of ~1000" in counter.status()
+    # There is no ETA if the total isn't known
+    counter = Counter("merge:user_interests")
+    counter.written += 10
+    assert counter.eta() is None
+
+def test_progress():
+    progress = Progress()
+    progress.begin("import:users", 100)
+    progress.read("import:users", 100)
+    progress.wrote("import:users", 60)
+    progress.wrote("import:users", 40)
+    # A table that wasn't started gets started when it's counted
+    progress.wrote("merge:users", 5)
+    assert "import:users" in progress.status()
+    progress.finish("import:users")
+    assert "import:users" not in progress.status()
+    summary = progress.summary(command="import")
+    assert summary['command'] == "import"
+    assert summary['tables']['import:users']['written'] == 100
+    assert summary['tables']['import:users']['finished']
+    assert summary['tables']['merge:users']['written'] == 5
+    assert not summary['tables']['merge:users']['finished']
+
+def test_write():
+    progress = Progress()
+    progress.begin("sync:tasks")
+    progress.wrote("sync:tasks", 10)
+    progress.finish("sync:tasks")
+    with tempfile.NamedTemporaryFile(suffix=".json") as file:
+        progress.write(file.name, version="0.1.0")
+        data = json.load(open(file.name))
+    assert data['version'] == "0.1.0"
+    assert data['tables']['sync:tasks']['written'] == 10
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    print("--- test_counter() ---")
+    test_counter()
+
+    print("--- test_progress() ---")
+    test_progress()
+
+    print("--- test_write() ---")
+    test_write()
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test building the parameterized queries used by PGSupport
+"""
+
+import argparse
+import logging
+import sys
+import os
+import asyncio
+from datetime import datetime
+from shapely.geometry import Point
+from shapely import wkb
+from tm_admin.pgsupport import PGSupport, enumCodec, encodeJson, encodeGeometry
+from tm_admin.types_tm import Projectdifficulty, Mappingtypes, Teamrole
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+def test_value():
+    pgs = PGSupport()
+    asyncio.run(pgs.getTypes("projects"))
+    # Enums become the name, whether they're the Enum or the integer value
+    assert pgs.toValue("difficulty", Projectdifficulty.CHALLENGING) == "CHALLENGING"
+    assert pgs.toValue("difficulty", Projectdifficulty.CHALLENGING.value) == "CHALLENGING"
+    assert pgs.toValue("difficulty", "EASY") == "EASY"
+    assert pgs.toValue("mapping_types", Mappingtypes.ROADS) == ["ROADS"]
+    assert pgs.toValue("priority_areas", [1, 2]) == [1, 2]
+    assert pgs.toValue("featured", "false") is False
+    assert pgs.toValue("id", "15") == 15
+    assert pgs.toValue("created", "2022-10-15 09:58:02") == datetime(2022, 10, 15, 9, 58, 2)
+    assert pgs.toValue("centroid", Point(1, 2)) == "POINT (1 2)"
+    assert pgs.toValue("odk", {"role": Teamrole.TEAM_MAPPER}) == '{"role": "TEAM_MAPPER"}'
+
+def test_where():
+    pgs = PGSupport()
+    asyncio.run(pgs.getTypes("projects"))
+    check, args = pgs.getWhere({"id": 1, "difficulty": Projectdifficulty.EASY}, 3)
+    assert check == " WHERE id = $3 AND difficulty = $4"
+    assert args == [1, "EASY"]
+    # Different values make the same query, so it only gets prepared once
+    assert pgs.getWhere({"id": 2, "difficulty": "MODERATE"}, 3)[0] == check
+
+    check, args = pgs.getWhere({"members": {"role": Teamrole.TEAM_MAPPER}, "odk": "null"})
+    assert check == " WHERE members->'members' @? $1::jsonpath AND odk IS NOT NULL"
+    assert args == ['$[*] ? (@.role == "TEAM_MAPPER")']
+
+    try:
+        pgs.getWhere({"id = 1; DROP TABLE projects; --": 1})
+        assert False
+    except ValueError:
+        pass
+
+def test_insert():
+    pgs = PGSupport()
+    asyncio.run(pgs.getTypes("projects"))
+    sql = pgs.getInsert(("id", "centroid", "odk"), 2)
+    assert sql == "INSERT INTO projects(id, centroid, odk) VALUES($1, ST_GeomFromText($2, 4326), $3::jsonb), ($4, ST_GeomFromText($5, 4326), $6::jsonb) RETURNING id"
+    assert pgs.getInsert((), 1) == "INSERT INTO projects DEFAULT VALUES RETURNING id"
+
+def test_update():
+    pgs = PGSupport()
+    asyncio.run(pgs.getTypes("projects"))
+    sql = pgs.getUpdate(("id",), ("difficulty", "centroid"))
+    assert sql == "UPDATE projects SET difficulty = updates.difficulty, centroid = ST_GeomFromText(updates.centroid, 4326) FROM unnest($1::bigint[], $2::public.projectdifficulty[], $3::text[]) AS updates(id, difficulty, centroid) WHERE projects.id = updates.id RETURNING projects.id"
+    # Array columns can't be unnested
+    assert asyncio.run(pgs.updateRecords([{"id": 1, "priority_areas": [1, 2]}])) == list()
+
+def test_codecs():
+    encoder, decoder = enumCodec(Teamrole)
+    assert encoder(Teamrole.TEAM_MAPPER) == "TEAM_MAPPER"
+    assert encoder(2) == "TEAM_MAPPER"
+    assert decoder("TEAM_MAPPER") is Teamrole.TEAM_MAPPER
+    try:
+        decoder("NOT_AN_ENUM")
+        assert False
+    except ValueError:
+        pass
+
+    # The values from toValue() are already encoded
+    assert encodeJson('{"role": "TEAM_MAPPER"}') == '{"role": "TEAM_MAPPER"}'
+    assert encodeJson({"role": "TEAM_MAPPER"}) == '{"role": "TEAM_MAPPER"}'
+
+    data = encodeGeometry(Point(1, 2))
+    assert wkb.loads(data).equals(Point(1, 2))
+    assert encodeGeometry(data) == data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    print("--- test_value() ---")
+    test_value()
+
+    print("--- test_where() ---")
+    test_where()
+
+    print("--- test_insert() ---")
+    test_insert()
+
+    print("--- test_update() ---")
+    test_update()
+
+    print("--- test_codecs() ---")
+    test_codecs()
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test the pipeline used to stage the TM tables
+"""
+
+import argparse
+import logging
+import sys
+import os
+import asyncio
+from tm_admin.pipeline import Pipeline
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+async def reader(batches: int,
+                 size: int,
+                 counts: dict,
+                 ):
+    for batch in range(0, batches):
+        counts['read'] += 1
+        # There are never more batches in memory than the queues hold,
+        # plus one being read, one transformed, and one for each writer.
+        # With a depth of 2 and 3 writers, that's 2 + 6 + 1 + 1 + 3.
+        assert counts['read'] - counts['written'] <= 13
+        yield list(range(batch * size, (batch + 1) * size))
+
+def test_run():
+    counts = {'read': 0, 'written': 0}
+    output = list()
+    async def writer(batch):
+        await asyncio.sleep(0.001)
+        output.extend(batch)
+        counts['written'] += 1
+
+    pipeline = Pipeline('test', 2)
+    records = asyncio.run(pipeline.run(reader(50, 10, counts), lambda batch: [value * 2 for value in batch], writer, 3))
+    assert records == 500
+    assert sorted(output) == [value * 2 for value in range(0, 500)]
+    assert pipeline.stages['read'].batches == 50
+    assert pipeline.stages['write'].records == 500
+    for queue in pipeline.queues:
+        assert queue.deepest <= queue.maxsize
+    assert "records/s" in pipeline.summary()
+
+def test_error():
+    counts = {'read': 0, 'written': 0}
+    async def writer(batch):
+        if batch[0] >= 100:
+            raise ValueError("Can't write")
+        counts['written'] += 1
+
+    pipeline = Pipeline('test')
+    try:
+        asyncio.run(pipeline.run(reader(50, 10, counts), None, writer, 2))
+        raise AssertionError("The writer's error wasn't raised")
+    except ValueError:
+        pass
+    # The reader stops when the writers fail
+    assert counts['read'] < 50
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    print("--- test_run() ---")
+    test_run()
+
+    print("--- test_error() ---")
+    test_error()
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test scheduling the import and merge of tables
+"""
+
+import argparse
+import logging
+import sys
+import os
+import asyncio
+from tm_admin.scheduler import Scheduler
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+async def job(name: str,
+              delay: float,
+              finished: list,
+              ):
+    await asyncio.sleep(delay)
+    finished.append(name)
+
+def test_depends():
+    finished = list()
+    sched = Scheduler(4)
+    sched.add("merge:users", job, "merge:users", 0.01, finished, depends=["import:users"])
+    sched.add("import:users", job, "import:users", 0.05, finished)
+    sched.add("import:teams", job, "import:teams", 0.01, finished)
+    # This isn't scheduled, so is assumed to be done
+    sched.add("merge:tasks", job, "merge:tasks", 0.01, finished, depends=["import:tasks"])
+    asyncio.run(sched.run())
+
+    assert len(finished) == 4
+    assert finished.index("import:users") < finished.index("merge:users")
+    # The independent jobs don't wait for the slow one
+    assert finished.index("import:teams") < finished.index("import:users")
+
+    path, length = sched.criticalPath()
+    assert path == ["import:users", "merge:users"]
+    assert length >= 0.06
+    assert "Critical path: import:users -> merge:users" in sched.summary()
+
+def test_slots():
+    finished = list()
+    sched = Scheduler(1)
+    sched.add("a", job, "a", 0.02, finished)
+    sched.add("b", job, "b", 0.02, finished)
+    asyncio.run(sched.run())
+    # Only one at a time, so the second starts after the first ends
+    first, second = sorted(sched.timing.values())
+    assert second[0] >= first[0] + first[1]
+
+def test_loop():
+    sched = Scheduler()
+    sched.add("a", job, "a", 0, [], depends=["b"])
+    sched.add("b", job, "b", 0, [], depends=["a"])
+    try:
+        sched.order()
+        assert False
+    except ValueError:
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    print("--- test_depends() ---")
+    test_depends()
+
+    print("--- test_slots() ---")
+    test_slots()
+
+    print("--- test_loop() ---")
+    test_loop()
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test the schema read from the yaml config files
+"""
+
+import argparse
+import logging
+import sys
+import os
+from tm_admin.schema import getSchema
+from tm_admin.pgsupport import PGSupport
+from tm_admin.types_tm import Mappingtypes, Projectdifficulty
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+def test_schema():
+    schema = getSchema()
+    # It's only read once
+    assert getSchema() is schema
+
+    columns = schema.getColumns("projects")
+    assert columns['id'].datatype == "int"
+    assert columns['difficulty'].enum is Projectdifficulty
+    assert not columns['difficulty'].array
+    assert columns['mapping_types'].datatype == "public.mappingtypes[]"
+    assert columns['mapping_types'].enum is Mappingtypes
+    assert columns['mapping_types'].array
+    assert schema.getTypes("projects")['geometry'] == "Polygon"
+    assert schema.enums['Mappingtypes'] is Mappingtypes
+
+    # It can't be changed
+    try:
+        schema.getTypes("projects")['id'] = "str"
+        assert False
+    except TypeError:
+        pass
+
+def test_shared():
+    # The API classes get their types without reading the yaml files
+    first = PGSupport("projects")
+    second = PGSupport("projects")
+    assert first.types is second.types
+    assert first.types is getSchema().getTypes("projects")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    print("--- test_schema() ---")
+    test_schema()
+
+    print("--- test_shared() ---")
+    test_shared()
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test the queries used to sync changes from TM
+"""
+
+import argparse
+import logging
+import sys
+import os
+from tm_admin.sync import primary, auxtables, getQuery
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+def test_primary():
+    for table, config in primary.items():
+        # The filter is between the last watermark and the new one
+        assert "$1" in config['filter'] and "$2" in config['filter']
+        assert config['watermark'][:10] == "SELECT max"
+
+def test_aux():
+    for table, config in auxtables.items():
+        assert config['target'] in ['users', 'projects', 'tasks', 'campaigns', 'organizations', 'teams']
+        # History gets appended, so it has to have a watermark
+        if config.get('append', False):
+            assert 'watermark' in config
+        sql = getQuery(config['select'], filter="true")
+        assert sql.find("{") < 0
+        sql = getQuery(config['update'], stage=f"sync_{table}")
+        assert f"sync_{table}" in sql
+
+    sql = getQuery(auxtables['task_history']['update'], stage="sync_task_history")
+    assert """'{"history": []}'""" in sql
+    assert "created = LEAST(tasks.created, s.created)" in sql
+
+def test_shared():
+    # The sync uses the same SQL as the merge, so they get the same results
+    sql = getQuery(auxtables['task_history']['select'], filter="true")
+    assert "DISTINCT ON (task_history_id)" in sql
+    assert "ORDER BY h.action_date, h.id" in sql
+    assert "u00a0" in sql
+    sql = getQuery(auxtables['project_allowed_users']['select'], filter="true")
+    assert "LEFT JOIN (SELECT id FROM users WHERE role > 0) m" in sql
+    assert "JOIN users u" not in sql
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    print("--- test_primary() ---")
+    test_primary()
+
+    print("--- test_aux() ---")
+    test_aux()
+
+    print("--- test_shared() ---")
+    test_shared()
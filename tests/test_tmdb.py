@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""
+Test converting TM records for importing
+"""
+
+import argparse
+import logging
+import sys
+import os
+import asyncio
+from datetime import datetime
+from shapely import wkb
+from shapely.geometry import MultiPolygon, Polygon, Point, mapping
+from tm_admin.yamlfile import YamlFile
+import tm_admin.tmdb
+from tm_admin.tmdb import RowConverter, SqlConverter, TMImport, ColumnBatch, toWkb, splitRange
+from osm_rawdata.pgasync import PostgresClient
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+import tm_admin as tma
+rootdir = tma.__path__[0]
+
+def test_users():
+    config = YamlFile(f"{rootdir}/users/users.yaml").getEntries()
+    columns = ['id', 'username', 'role', 'mapping_level', 'is_expert', 'projects_mapped', 'not_in_config']
+    conv = RowConverter(config, columns)
+    # name is required, but not in the TM columns
+    assert conv.columns == ['id', 'username', 'role', 'mapping_level', 'is_expert', 'projects_mapped', 'name']
+
+    data = [(1, 'foo', 0, 2, None, [], 'ignored'),
+            (2, 'bar', 8, 0, True, [1, 2], 'ignored'),
+            ]
+    records = conv.convert(data)
+    assert records[0] == (1, 'foo', 'READ_ONLY', 'INTERMEDIATE', False, None, '')
+    assert records[1] == (2, 'bar', 'MAPPER', 'BEGINNER', True, [1, 2], '')
+
+def test_tasks():
+    config = YamlFile(f"{rootdir}/tasks/tasks.yaml").getEntries()
+    columns = ['id', 'project_id', 'geometry', 'task_status']
+    conv = RowConverter(config, columns)
+    # created is a required timestamp that isn't in TM
+    assert conv.columns == ['id', 'project_id', 'geometry', 'task_status', 'created']
+
+    coords = ((0., 0.), (0., 1.), (1., 1.), (1., 0.), (0., 0.))
+    geom = MultiPolygon([Polygon(coords)])
+    records = conv.convert([(1, 2, geom.wkb_hex, 3)])
+    assert wkb.loads(records[0][2]).equals(Polygon(coords))
+    assert records[0][3] == 'TASK_STATUS_MAPPED'
+    assert type(records[0][4]) == datetime
+
+def test_projects():
+    config = YamlFile(f"{rootdir}/projects/projects.yaml").getEntries()
+    columns = ['id', 'mapping_editors', 'country', 'status']
+    conv = RowConverter(config, columns)
+    records = conv.convert([(1, [0, 2], [], 2), (2, None, ['Nepal'], None)])
+    assert records[0][:4] == (1, ['ID', 'JOSM'], None, 'PUBLISHED')
+    # status is required, so gets the first entry in the enum
+    assert records[1][:4] == (2, None, ['Nepal'], 'ARCHIVED')
+
+def test_geometry():
+    coords = ((0., 0.), (0., 1.), (1., 1.), (1., 0.), (0., 0.))
+    polygon = Polygon(coords)
+    values = [MultiPolygon([polygon]).wkb_hex, None, mapping(polygon), polygon.wkb]
+    result = toWkb(values, 'polygon')
+    assert len(result) == 4
+    assert result[1] is None
+    for index in (0, 2, 3):
+        assert wkb.loads(result[index]).equals(polygon)
+
+    result = toWkb([Point(1, 2).wkb_hex, mapping(Point(3, 4))], 'point')
+    assert wkb.loads(result[0]).equals(Point(1, 2))
+    assert wkb.loads(result[1]).equals(Point(3, 4))
+
+def test_batch():
+    config = YamlFile(f"{rootdir}/tasks/tasks.yaml").getEntries()
+    conv = RowConverter(config, ['id', 'project_id', 'geometry'])
+    coords = ((0., 0.), (0., 1.), (1., 1.), (1., 0.), (0., 0.))
+    geom = MultiPolygon([Polygon(coords)]).wkb_hex
+    data = [(index, 1, geom) for index in range(100)]
+    # Force the geometries to be converted in another process
+    threshold = tm_admin.tmdb.geothreshold
+    tm_admin.tmdb.geothreshold = 10
+    records = asyncio.run(conv.convertBatch(data))
+    tm_admin.tmdb.geothreshold = threshold
+    assert records == conv.convert(data)
+    assert wkb.loads(records[99][2]).equals(Polygon(coords))
+
+def test_sql():
+    config = YamlFile(f"{rootdir}/users/users.yaml").getEntries()
+    columns = {'id': 'int8', 'username': 'varchar', 'role': 'int4', 'mapping_level': 'int4', 'is_expert': 'bool', 'projects_mapped': '_int4', 'not_in_config': 'text'}
+    conv = SqlConverter(config, columns)
+    # The same columns as the RowConverter
+    assert conv.columns == RowConverter(config, list(columns.keys())).columns
+    select = dict(zip(conv.columns, conv.select))
+    assert select['id'] == "COALESCE(id, 0)"
+    assert select['is_expert'] == "COALESCE(is_expert, false)"
+    assert select['projects_mapped'] == "CASE WHEN cardinality(projects_mapped) = 0 THEN NULL ELSE projects_mapped END"
+    # A 0 from TM is the first entry in the enum
+    assert "WHEN role <= 1 THEN 'READ_ONLY'" in select['role']
+    assert "WHEN role = 8 THEN 'MAPPER'" in select['role']
+    assert select['role'].endswith("::public.roles")
+    # mapping_level is required, so NULL is the first entry
+    assert "WHEN mapping_level IS NULL THEN 'BEGINNER'" in select['mapping_level']
+    assert select['name'] == "''"
+    sql = conv.getInsert('users', 'tm.users')
+    assert sql.startswith("INSERT INTO users(id, username, role, mapping_level, is_expert, projects_mapped, name) SELECT ")
+    assert sql.endswith(" FROM tm.users")
+    sql = conv.getInsert('users', 'tm.users', "NOT (id) <= (300)")
+    assert sql.endswith(" FROM tm.users WHERE NOT (id) <= (300)")
+
+def test_sql_tasks():
+    config = YamlFile(f"{rootdir}/tasks/tasks.yaml").getEntries()
+    conv = SqlConverter(config, {'id': 'int4', 'geometry': 'geometry', 'task_status': 'varchar'})
+    select = dict(zip(conv.columns, conv.select))
+    assert select['geometry'] == "CASE WHEN GeometryType(geometry) = 'MULTIPOLYGON' THEN ST_GeometryN(geometry, 1) ELSE geometry END"
+    # Values that are already names only need a cast
+    assert select['task_status'].endswith("::public.taskstatus")
+    assert "CASE" not in select['task_status']
+
+def test_split():
+    # Without statistics the values are split evenly
+    assert splitRange(1, 100, 4) == [(1, 26), (26, 51), (51, 76), (76, 101)]
+    # The histogram puts more ranges where there are more records
+    bounds = [1, 2, 3, 4, 5, 6, 7, 8, 9, 1000]
+    splits = splitRange(1, 1000, 3, bounds)
+    assert splits == [(1, 4), (4, 7), (7, 1001)]
+    # There can't be more ranges than values
+    assert splitRange(5, 6, 4) == [(5, 6), (6, 7)]
+    assert splitRange(5, 5, 4) == [(5, 6)]
+
+def test_plan():
+    tmi = TMImport()
+    asyncio.run(tmi.loadConfig('users'))
+    tmi.tmdb = PostgresClient()
+    tmi.tmdb.dburi = {'dbhost': 'test', 'dbname': 'tm4'}
+    # Once the schema has been read, it isn't queried again
+    tm_admin.tmdb.tmschema[('test', 'tm4')] = {'users': {'id': ('bigint', 'int8'),
+                                                         'not_in_config': ('text', 'text'),
+                                                         'role': ('integer', 'int4'),
+                                                         'username': ('character varying', 'varchar'),
+                                                         }}
+    plan = asyncio.run(tmi.getPlan('users'))
+    # The columns are in the TM order, without the ones not in the config
+    assert plan == ['id', 'role', 'username']
+    columns = asyncio.run(tmi.getColumns('users'))
+    assert columns == {'id': 0, 'not_in_config': '', 'role': 0, 'username': ''}
+    assert asyncio.run(tmi.getPlan('missing')) == list()
+    del tm_admin.tmdb.tmschema[('test', 'tm4')]
+
+def test_columns():
+    config = YamlFile(f"{rootdir}/users/users.yaml").getEntries()
+    columns = ['id', 'username', 'role', 'mapping_level', 'is_expert', 'projects_mapped']
+    conv = RowConverter(config, columns)
+    data = [(1, 'foo', 0, 2, None, []),
+            (2, 'bar', 8, 0, True, [1, 2]),
+            (3, 'baz', 8, None, False, None),
+            ]
+    batch = ColumnBatch(list(zip(*data)), columns)
+    result = conv.convertColumns(batch)
+    assert result.names == conv.columns
+    assert list(result.rows()) == conv.convert(data)
+    # The records with the same enum share the same string
+    role = conv.columns.index('role')
+    assert result.columns[role][1] is result.columns[role][2]
+
+def test_column_geometry():
+    config = YamlFile(f"{rootdir}/tasks/tasks.yaml").getEntries()
+    columns = ['id', 'project_id', 'geometry', 'task_status']
+    conv = RowConverter(config, columns)
+    coords = ((0., 0.), (0., 1.), (1., 1.), (1., 0.), (0., 0.))
+    geom = MultiPolygon([Polygon(coords)]).wkb_hex
+    data = [(index, 1, geom, index % 3) for index in range(100)]
+    batch = ColumnBatch(list(zip(*data)), columns)
+    threshold = tm_admin.tmdb.geothreshold
+    tm_admin.tmdb.geothreshold = 10
+    result = asyncio.run(conv.convertBatch(batch))
+    tm_admin.tmdb.geothreshold = threshold
+    assert len(result) == 100
+    assert list(result.rows()) == conv.convert(data)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    print("--- test_users() ---")
+    test_users()
+
+    print("--- test_tasks() ---")
+    test_tasks()
+
+    print("--- test_projects() ---")
+    test_projects()
+
+    print("--- test_geometry() ---")
+    test_geometry()
+
+    print("--- test_batch() ---")
+    test_batch()
+
+    print("--- test_sql() ---")
+    test_sql()
+
+    print("--- test_sql_tasks() ---")
+    test_sql_tasks()
+
+    print("--- test_split() ---")
+    test_split()
+
+    print("--- test_plan() ---")
+    test_plan()
+
+    print("--- test_columns() ---")
+    test_columns()
+
+    print("--- test_column_geometry() ---")
+    test_column_geometry()
@@ -27,24 +27,19 @@ from sys import argv
 from datetime import datetime
 from dateutil.parser import parse
 import tm_admin.types_tm
+from tm_admin.schema import getSchema
 from tm_admin.types_tm import Roles, Mappinglevel, Teammemberfunctions
 import concurrent.futures
-from cpuinfo import get_cpu_info
 from tm_admin.dbsupport import DBSupport
+from tm_admin.dbpool import DBPool
 from tm_admin.users.users_class import UsersTable
 from osm_rawdata.pgasync import PostgresClient
-from tqdm import tqdm
-import tqdm.asyncio
 from codetiming import Timer
 import asyncio
 
 # Instantiate logger
 log = logging.getLogger(__name__)
 
-# The number of threads is based on the CPU cores
-info = get_cpu_info()
-cores = info["count"] * 2
-
 class CampaignsDB(DBSupport):
     def __init__(self,
                  dburi: str = "localhost/tm_admin",
@@ -60,7 +55,7 @@ class CampaignsDB(DBSupport):
         """
         self.pg = None
         self.profile = UsersTable()
-        self.types = dir(tm_admin.types_tm)
+        self.types = getSchema().enums
         super().__init__('campaigns')
 
     async def mergeOrganizations(self,
@@ -68,7 +63,8 @@ class CampaignsDB(DBSupport):
                         ):
         """
         A method to merge the contents of the TM campaign_organizations into
-        the campaigns table as an array.
+        the campaigns table as an array. Each campaign is written once,
+        with all of it's organizations.
 
         Args:
             inpg (PostgresClient): The input database
@@ -76,41 +72,67 @@ class CampaignsDB(DBSupport):
         # FIXME: this is a weird table, and only has 4 entries, none of which appear
         # to be in the other tables, so nothing updates.
         table = 'campaign_organisations'
-        sql = f"SELECT * FROM {table} ORDER BY campaign_id"
-        # print(sql)
-        result = await inpg.execute(sql)
-
-        data = dict()
-        pbar = tqdm.tqdm(result)
-        for record in result:
-            sql = f" UPDATE campaigns SET organizations = organizations||{record['organisation_id']} WHERE id={record['campaign_id']};"
-            # print(sql)
-            await self.pg.execute(sql)
+        stages = [(f"tm_{table}",
+                   "campaign_id int, organisation_id int",
+                   f"SELECT campaign_id, organisation_id FROM {table}"),
+                  ]
+        sql = f"""UPDATE campaigns SET organizations = s.organizations
+            FROM (SELECT campaign_id, array_agg(organisation_id ORDER BY organisation_id) AS organizations
+                FROM tm_{table} GROUP BY campaign_id) AS s
+            WHERE campaigns.id = s.campaign_id"""
+        await self.mergeStaged(inpg, stages, [sql])
+
+        return True
 
     async def mergeProjects(self,
                         inpg: PostgresClient,
                         ):
         """
         A method to merge the contents of the TM campaign_projects into
-        the campaigns table as an array.
+        the campaigns table as an array. Each campaign is written once,
+        with all of it's projects.
 
         Args:
             inpg (PostgresClient): The input database
         """
         table = 'campaign_projects'
-        sql = f"SELECT * FROM {table} ORDER BY campaign_id"
-        # print(sql)
-        result = await inpg.execute(sql)
-
-        index = 0
-        data = dict()
-        pbar = tqdm.tqdm(result)
-
-        for record in pbar:
-            sql = f" UPDATE campaigns SET projects = projects||{record['project_id']} WHERE id={record['campaign_id']};"
-            # print(sql)
-            await self.pg.execute(sql)
-    
+        stages = [(f"tm_{table}",
+                   "campaign_id int, project_id int",
+                   f"SELECT campaign_id, project_id FROM {table}"),
+                  ]
+        sql = f"""UPDATE campaigns SET projects = s.projects
+            FROM (SELECT campaign_id, array_agg(project_id ORDER BY project_id) AS projects
+                FROM tm_{table} GROUP BY campaign_id) AS s
+            WHERE campaigns.id = s.campaign_id"""
+        await self.mergeStaged(inpg, stages, [sql])
+
+        return True
+
+    async def mergeAuxTables(self,
+                             inuri: str,
+                             outuri: str,
+                             pool: DBPool = None,
+                             resume: bool = False,
+                             ):
+        """
+        Merge more tables from TM into the unified campaigns table.
+
+        Args:
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
+        """
+        await self.connect(outuri)
+        await self.connectPool(outuri, pool, resume)
+
+        inpg = PostgresClient()
+        await inpg.connect(inuri)
+
+        await self.mergeStep('campaign_projects', self.mergeProjects, inpg)
+
+        await self.mergeStep('campaign_organisations', self.mergeOrganizations, inpg)
+
 async def main():
     """This main function lets this class be run standalone by a bash script."""
     parser = argparse.ArgumentParser()
@@ -138,15 +160,9 @@ async def main():
         stream=sys.stdout,
     )
 
-    inpg = PostgresClient()
-    await inpg.connect(args.inuri)
-
-    camp = camp = CampaignsDB(args.inuri)
-    await camp.connect(args.outuri)
+    camp = CampaignsDB(args.inuri)
+    await camp.mergeAuxTables(args.inuri, args.outuri)
 
-    await camp.mergeProjects(inpg)
-    await camp.mergeOrganizations(inpg)
-    
 if __name__ == "__main__":
     """This is just a hook so this file can be run standalone during development."""
     loop = asyncio.new_event_loop()
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetMap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import argparse
+import logging
+import sys
+import os
+from urllib.parse import urlparse
+from contextlib import asynccontextmanager
+import asyncpg
+import asyncio
+from osm_rawdata.pgasync import PostgresClient
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+async def initConnection(con: asyncpg.Connection):
+    """
+    Setup each new connection in the pool. Binary COPY needs an encoder
+    for the PostGIS geometry type. The geometry values are already
+    converted to WKB, so pass them through.
+
+    Args:
+        con (asyncpg.Connection): The new database connection
+    """
+    try:
+        await con.set_type_codec('geometry',
+                                 schema='public',
+                                 encoder=bytes,
+                                 decoder=bytes,
+                                 format='binary',
+                                 )
+    except ValueError:
+        # The postgis extension isn't in this database
+        log.debug("No geometry type in the database")
+
+class DBPool(object):
+    def __init__(self,
+                 minsize: int = 2,
+                 maxsize: int = 8,
+                 ):
+        """
+        A pool of database connections that is created once, and shared
+        by all of the workers when importing or merging data. This limits
+        the number of connections to the database server, and avoids
+        the overhead of connecting for every chunk of data.
+
+        Args:
+            minsize (int): The number of connections to open at startup
+            maxsize (int): The maximum number of connections in use at once
+
+        Returns:
+            (DBPool): An instance of this class
+        """
+        self.minsize = min(minsize, maxsize)
+        self.maxsize = maxsize
+        self.pool = None
+        self.dburi = dict()
+        # Workers wait here for a free connection
+        self.semaphore = asyncio.Semaphore(maxsize)
+
+    async def connect(self,
+                      dburi: str = "localhost/tm_admin",
+                      ):
+        """
+        Create the pool of connections to the database. The URI is
+        the same format used by PostgresClient.
+
+        Args:
+            dburi (str): The URI string for the database connection
+        """
+        uri = urlparse(dburi)
+        self.dburi["dbuser"] = uri.username or os.getenv("PGUSER", default=None)
+        self.dburi["dbpass"] = uri.password or os.getenv("PGPASSWORD", default=None)
+        self.dburi["dbhost"] = uri.hostname or os.getenv("PGHOST", default="localhost")
+        slash = uri.path.find("/")
+        self.dburi["dbname"] = uri.path[slash + 1 :]
+
+        self.pool = await asyncpg.create_pool(user=self.dburi["dbuser"],
+                                              password=self.dburi["dbpass"],
+                                              host=self.dburi["dbhost"],
+                                              database=self.dburi["dbname"],
+                                              min_size=self.minsize,
+                                              max_size=self.maxsize,
+                                              init=initConnection,
+                                              )
+        log.info(f"Created a pool of {self.minsize} to {self.maxsize} connections to {self.dburi['dbname']}")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """
+        Get a connection from the pool. It is wrapped in a PostgresClient
+        so it can be used by all the existing code, and returned to the
+        pool when done.
+
+        Returns:
+            (PostgresClient): A database connection from the pool
+        """
+        async with self.semaphore:
+            async with self.pool.acquire() as con:
+                db = PostgresClient()
+                db.pg = con
+                db.dburi = self.dburi
+                yield db
+
+    async def run(self,
+                  func,
+                  data: list,
+                  *args,
+                  ):
+        """
+        Run a worker with a connection from the pool. All of the worker
+        threads take the data as the first parameter, and the database
+        connection as the second.
+
+        Args:
+            func (function): The worker to run
+            data (list): The data for the worker to process
+            args: Any other parameters for the worker
+
+        Returns:
+            The return value from the worker
+        """
+        async with self.acquire() as db:
+            return await func(data, db, *args)
+
+    async def close(self):
+        """
+        Close all the connections in the pool.
+        """
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+async def main():
+    """This main function lets this class be run standalone by a bash script."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    parser.add_argument("-u", "--uri", default='localhost/tm_admin',
+                            help="Database URI")
+    parser.add_argument("-m", "--maxsize", type=int, default=8,
+                            help="The maximum number of connections")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    pool = DBPool(maxsize=args.maxsize)
+    await pool.connect(args.uri)
+    async with pool.acquire() as db:
+        result = await db.execute("SELECT count(*) FROM pg_stat_activity")
+        print(result)
+    await pool.close()
+
+if __name__ == "__main__":
+    """This is just a hook so this file can be run standalone during development."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main())
@@ -27,6 +27,7 @@ from sys import argv
 from datetime import datetime
 from dateutil.parser import parse
 import tm_admin.types_tm
+from tm_admin.schema import getSchema
 from tm_admin.organizations.organizations_class import OrganizationsTable
 from tm_admin.users.users_class import UsersTable
 from tm_admin.teams.teams_class import TeamsTable
@@ -36,6 +37,10 @@ from tm_admin.campaigns.campaigns_class import CampaignsTable
 from tm_admin.messages.messages_class import MessagesTable
 from tm_admin.organizations.organizations_class import OrganizationsTable
 from osm_rawdata.pgasync import PostgresClient
+from tm_admin.dbpool import DBPool
+from tm_admin.journal import Journal
+from tm_admin.pipeline import Pipeline
+from tm_admin.metrics import progress
 from shapely.geometry import Polygon, Point, shape
 import asyncio
 from codetiming import Timer
@@ -43,6 +48,62 @@ from codetiming import Timer
 # Instantiate logger
 log = logging.getLogger(__name__)
 
+# The number of rows sent to postgres in each executemany()
+batchsize = 1000
+
+# The number of rows read from TM at a time when staging a table
+stagesize = 10000
+
+def partition(rows: list,
+              key: tuple,
+              count: int,
+              ):
+    """
+    Split the rows between the workers by a hash of the key they
+    update, so all the rows for a record go to the same worker, and
+    no two workers ever try to lock the same record.
+
+    Args:
+        rows (list): The list of tuples with the parameters for a query
+        key (tuple): The positions of the key columns in each row
+        count (int): The number of workers
+
+    Returns:
+        (list): A list of rows for each worker, in their original order
+    """
+    parts = [list() for index in range(0, count)]
+    for row in rows:
+        parts[hash(tuple([row[index] for index in key])) % count].append(row)
+
+    return parts
+
+async def updateManyThread(
+    rows: list,
+    db: PostgresClient,
+    sql: str,
+    batch: int = batchsize,
+    name: str = None,
+):
+    """Thread to run a parameterized query for many rows. The query
+    is prepared once, and the rows sent in batches. Since no other
+    worker updates the same records, they all go in one transaction.
+
+    Args:
+        rows (list): The list of tuples with the parameters for the query
+        db (PostgresClient): A database connection
+        sql (str): The SQL query, using $1, $2, etc... for the parameters
+        batch (int): The number of rows in each batch
+        name (str): The name to count the rows written under
+    """
+    async with db.pg.transaction():
+        stmt = await db.pg.prepare(sql)
+        for block in range(0, len(rows), batch):
+            await stmt.executemany(rows[block:block + batch])
+    if name:
+        progress.wrote(name, len(rows))
+
+    return True
+
 class DBSupport(object):
     def __init__(self,
                  table: str,
@@ -57,7 +118,14 @@ class DBSupport(object):
             (DBSupport): An instance of this class
         """
         self.pg = None
+        self.pool = None
+        self.journal = None
+        self.resume = False
         self.table = table
+        # The name of the merge step being run, for the progress
+        self.step = None
+        # The TM table being merged by mergeStep(), for the journal
+        self.merging = None
         self.columns = None
 
     async def connect(self,
@@ -72,10 +140,213 @@ class DBSupport(object):
         if dburi:
             self.pg = PostgresClient()
             await self.pg.connect(dburi)
-        self.types = dir(tm_admin.types_tm)
+        self.types = getSchema().enums
         # self.schema = self.getColumns(table)
         #self.accessors = dict()
 
+    async def connectPool(self,
+                    dburi: str = "localhost/tm_admin",
+                    pool: DBPool = None,
+                    resume: bool = False,
+                    ):
+        """
+        Use a shared pool of connections for the worker threads. If
+        there isn't one already, create it. This also sets up the
+        journal that tracks which tables have been merged.
+
+        Args:
+            dburi (str): The URI string for the database connection.
+            pool (DBPool): The shared pool of connections
+            resume (bool): Skip the tables already merged by a previous run
+        """
+        if pool is None:
+            pool = DBPool()
+            await pool.connect(dburi)
+        self.pool = pool
+
+        self.resume = resume
+        self.journal = Journal(self.pool)
+        await self.journal.create()
+
+    async def mergeStep(self,
+                    table: str,
+                    func,
+                    *args,
+                    ):
+        """
+        Merge one of the TM tables, and record it in the journal when
+        it's done. If resuming, tables that are done get skipped.
+
+        Args:
+            table (str): The TM table being merged
+            func (function): The method that does the merge
+            args: The parameters for the method
+
+        Returns:
+            The return value from the method
+        """
+        if self.resume and await self.journal.isDone(table, 'merge'):
+            log.info(f"The '{table}' table has already been merged")
+            return True
+
+        await self.journal.reset(table, 'merge')
+        self.step = f"merge:{table}"
+        # mergeStaged() records the table as done in the same transaction
+        # as the updates, and then clears this.
+        self.merging = table
+        progress.begin(self.step)
+        try:
+            result = await func(*args)
+            if self.merging is not None:
+                await self.journal.finish(table, 'merge')
+        finally:
+            progress.finish(self.step)
+            self.step = None
+            self.merging = None
+
+        return result
+
+    async def updateMany(self,
+                    sql: str,
+                    rows: list,
+                    key: tuple = (-1,),
+                    batch: int = batchsize,
+                    ):
+        """
+        Run a parameterized query for many rows, split between the
+        connections in the pool. This is used by the merges instead of
+        building a literal SQL query for each row, so postgres only has
+        to parse and plan the query once, and the values never need to
+        be quoted. The rows are split by a hash of the key, so each
+        worker owns the records it updates and never waits on a lock
+        held by another.
+
+        Args:
+            sql (str): The SQL query, using $1, $2, etc... for the parameters
+            rows (list): The list of tuples with the parameters for the query
+            key (tuple): The positions of the key columns in each row, by
+                         default the last one, which is usually the id
+            batch (int): The number of rows in each executemany()
+
+        Returns:
+            (int): The number of rows
+        """
+        name = self.step or f"update:{self.table}"
+        progress.read(name, len(rows))
+        parts = partition(rows, key, self.pool.maxsize)
+        async with asyncio.TaskGroup() as tg:
+            for index, part in enumerate(parts):
+                if len(part) == 0:
+                    continue
+                log.debug(f"Dispatching thread {index} with {len(part)} rows")
+                tg.create_task(self.pool.run(updateManyThread, part, sql, batch, name))
+
+        return len(rows)
+
+    async def stageTable(self,
+                    inpg: PostgresClient,
+                    sql: str,
+                    stage: str,
+                    columns: str,
+                    ):
+        """
+        Copy the results of a query on the TM database into a staging
+        table in TM Admin. The rows are read through a server-side
+        cursor, and loaded with COPY by several writers at once, each
+        using a connection from the pool. The staging table is unlogged,
+        since it's only used till the merge is done.
+
+        Args:
+            inpg (PostgresClient): The connection to the TM database
+            sql (str): The query for the rows to stage
+            stage (str): The name of the staging table
+            columns (str): The column definitions for the staging table
+
+        Returns:
+            (int): The number of rows staged
+        """
+        names = [column.split()[0] for column in columns.split(',')]
+        name = self.step or f"stage:{stage}"
+        async with self.pool.acquire() as db:
+            await db.pg.execute(f"DROP TABLE IF EXISTS {stage}")
+            await db.pg.execute(f"CREATE UNLOGGED TABLE {stage} ({columns})")
+
+        async def read():
+            # A cursor can only be used inside a transaction
+            async with inpg.pg.transaction():
+                cursor = await inpg.pg.cursor(sql)
+                while True:
+                    records = await cursor.fetch(stagesize)
+                    if len(records) == 0:
+                        break
+                    progress.read(name, len(records))
+                    yield records
+
+        def transform(records):
+            return [tuple(record) for record in records]
+
+        async def write(records):
+            async with self.pool.acquire() as db:
+                await db.pg.copy_records_to_table(stage, records=records, columns=names)
+            progress.wrote(name, len(records))
+
+        # Leave a connection for the other tables being merged
+        pipeline = Pipeline(stage)
+        count = await pipeline.run(read(), transform, write, max(1, self.pool.maxsize - 1))
+        log.info(pipeline.summary())
+
+        async with self.pool.acquire() as db:
+            await db.pg.execute(f"ANALYZE {stage}")
+
+        return count
+
+    async def mergeStaged(self,
+                    inpg: PostgresClient,
+                    stages: list,
+                    updates: list,
+                    table: str = None,
+                    ):
+        """
+        Merge TM tables by staging them in TM Admin, and then applying
+        them with a few set based queries, usually an UPDATE ... FROM
+        that aggregates the staged rows for each record. The updates
+        all run in one transaction, so a merge that fails leaves nothing
+        behind, and the staging tables are dropped when done. The table
+        is recorded as merged in the journal in the same transaction, so
+        a merge that appends can't be applied twice when resuming.
+
+        Args:
+            inpg (PostgresClient): The connection to the TM database
+            stages (list): A (stage, columns, sql) tuple for each staging table
+            updates (list): The SQL queries that apply the staged rows
+            table (str): The TM table for the journal, by default the one mergeStep() is merging
+
+        Returns:
+            (list): The status of each update
+        """
+        result = list()
+        try:
+            for stage, columns, sql in stages:
+                await self.stageTable(inpg, sql, stage, columns)
+            async with self.pool.acquire() as db:
+                async with db.pg.transaction():
+                    for sql in updates:
+                        status = await db.pg.execute(sql)
+                        log.debug(f"{status}")
+                        result.append(status)
+                    table = table or self.merging
+                    if table and self.journal:
+                        await self.journal.checkpoint(db, table, 'merge')
+            if table == self.merging:
+                # Don't let mergeStep() record it again
+                self.merging = None
+        finally:
+            async with self.pool.acquire() as db:
+                for stage, columns, sql in stages:
+                    await db.pg.execute(f"DROP TABLE IF EXISTS {stage}")
+
+        return result
+
     async def createTable(self,
                     obj,
                     ):
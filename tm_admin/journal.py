@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetMap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import argparse
+import logging
+import sys
+import os
+import asyncio
+from osm_rawdata.pgasync import PostgresClient
+from tm_admin.dbpool import DBPool
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+import tm_admin as tma
+rootdir = tma.__path__[0]
+
+# The columns that uniquely identify a record in a TM table, in the
+# order the table is read in. Task IDs are only unique within a project.
+keycolumns = {
+    'tasks': ['project_id', 'id'],
+    }
+
+def getKeys(table: str):
+    """
+    Get the key columns for a TM table.
+
+    Args:
+        table (str): The name of the table
+
+    Returns:
+        (list): The columns that are the key for the table
+    """
+    return keycolumns.get(table, ['id'])
+
+def coalesce(ranges: list):
+    """
+    Join the ranges of keys that are next to each other. Each batch
+    starts after the last key of the previous one, so finished batches
+    join up into a few big ranges, with gaps where a batch never got
+    committed.
+
+    Args:
+        ranges (list): The (lower, upper) ranges of keys, None for the start
+
+    Returns:
+        (list): The joined ranges, sorted by key
+    """
+    result = list()
+    # None is the start of the table, so sorts first
+    for lower, upper in sorted(ranges, key=lambda r: (r[0] is not None, r[0] or [])):
+        if len(result) > 0 and result[-1][1] == lower:
+            result[-1] = (result[-1][0], upper)
+        else:
+            result.append((lower, upper))
+
+    return result
+
+def skipFilter(keys: list,
+               ranges: list,
+               ):
+    """
+    Create the SQL condition that skips the ranges of keys that
+    are already done.
+
+    Args:
+        keys (list): The key columns of the table
+        ranges (list): The (lower, upper) ranges of keys that are done
+
+    Returns:
+        (str): The condition, or an empty string if there is nothing to skip
+    """
+    if len(ranges) == 0:
+        return ""
+    columns = f"({', '.join(keys)})"
+    tests = list()
+    for lower, upper in ranges:
+        end = f"{columns} <= ({', '.join([str(key) for key in upper])})"
+        if lower is None:
+            tests.append(f"NOT {end}")
+        else:
+            start = f"{columns} > ({', '.join([str(key) for key in lower])})"
+            tests.append(f"NOT ({start} AND {end})")
+
+    return ' AND '.join(tests)
+
+class Journal(object):
+    def __init__(self,
+                 pool: DBPool,
+                 ):
+        """
+        A journal of the work done when importing or merging data from
+        the Tasking Manager, so a run that dies halfway can be resumed.
+        This is stored in a table in the TM Admin database, and a
+        checkpoint is written in the same transaction as the data it
+        covers, so it's never out of sync with what has been committed.
+
+        Args:
+            pool (DBPool): The pool of connections to the TM Admin database
+
+        Returns:
+            (Journal): An instance of this class
+        """
+        self.pool = pool
+
+    async def create(self):
+        """
+        Create the journal and watermark tables if they don't exist yet.
+        """
+        sql = ""
+        with open(f"{rootdir}/journal.sql", 'r') as file:
+            for line in file.readlines():
+                if line[:2] != '--':
+                    sql += line
+        async with self.pool.acquire() as db:
+            for cmd in sql.split(";"):
+                if len(cmd.strip()) > 0:
+                    await db.pg.execute(cmd)
+
+    async def reset(self,
+                    table: str,
+                    step: str,
+                    ):
+        """
+        Forget all the progress for a table, used when starting over.
+
+        Args:
+            table (str): The name of the table
+            step (str): The type of work, import or merge
+        """
+        async with self.pool.acquire() as db:
+            await db.pg.execute("DELETE FROM journal WHERE tablename = $1 AND step = $2", table, step)
+
+    async def checkpoint(self,
+                         db: PostgresClient,
+                         table: str,
+                         step: str,
+                         lower: list = None,
+                         upper: list = None,
+                         records: int = 0,
+                         ):
+        """
+        Record a range of keys as done. This uses the connection that
+        wrote the data, so it's part of the same transaction.
+
+        Args:
+            db (PostgresClient): The connection that wrote the data
+            table (str): The name of the table
+            step (str): The type of work, import or merge
+            lower (list): The key before this range, None for the start
+            upper (list): The last key in this range, None for all of it
+            records (int): The number of records in this range
+        """
+        sql = "INSERT INTO journal(tablename, step, lower, upper, records) VALUES($1, $2, $3, $4, $5)"
+        await db.pg.execute(sql, table, step, lower, upper, records)
+
+    async def finish(self,
+                     table: str,
+                     step: str,
+                     records: int = 0,
+                     ):
+        """
+        Record all the work for a table as done.
+
+        Args:
+            table (str): The name of the table
+            step (str): The type of work, import or merge
+            records (int): The number of records
+        """
+        async with self.pool.acquire() as db:
+            await self.checkpoint(db, table, step, records=records)
+
+    async def isDone(self,
+                     table: str,
+                     step: str,
+                     ):
+        """
+        See if all the work for a table is done.
+
+        Args:
+            table (str): The name of the table
+            step (str): The type of work, import or merge
+
+        Returns:
+            (bool): Whether the table is finished
+        """
+        sql = "SELECT count(*) FROM journal WHERE tablename = $1 AND step = $2 AND upper IS NULL"
+        async with self.pool.acquire() as db:
+            count = await db.pg.fetchval(sql, table, step)
+
+        return count > 0
+
+    async def getRanges(self,
+                        table: str,
+                        step: str,
+                        ):
+        """
+        Get the ranges of keys that are done for a table.
+
+        Args:
+            table (str): The name of the table
+            step (str): The type of work, import or merge
+
+        Returns:
+            (list): The (lower, upper) ranges of keys, joined up
+        """
+        sql = "SELECT lower, upper FROM journal WHERE tablename = $1 AND step = $2 AND upper IS NOT NULL"
+        async with self.pool.acquire() as db:
+            result = await db.pg.fetch(sql, table, step)
+
+        return coalesce([(record['lower'], record['upper']) for record in result])
+
+    async def getWatermark(self,
+                           table: str,
+                           ):
+        """
+        Get the watermark for a TM table from the last import or sync.
+
+        Args:
+            table (str): The name of the table
+
+        Returns:
+            (datetime): The watermark, or None if there isn't one
+        """
+        sql = "SELECT watermark FROM watermarks WHERE tablename = $1"
+        async with self.pool.acquire() as db:
+            return await db.pg.fetchval(sql, table)
+
+    async def setWatermark(self,
+                           table: str,
+                           watermark,
+                           ):
+        """
+        Set the watermark for a TM table.
+
+        Args:
+            table (str): The name of the table
+            watermark (datetime): The newest value of the watermark column
+        """
+        sql = "INSERT INTO watermarks(tablename, watermark) VALUES($1, $2) ON CONFLICT (tablename) DO UPDATE SET watermark = EXCLUDED.watermark, updated = now()"
+        async with self.pool.acquire() as db:
+            await db.pg.execute(sql, table, watermark)
+
+async def main():
+    """This main function lets this class be run standalone by a bash script."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    parser.add_argument("-u", "--uri", default='localhost/tm_admin',
+                            help="Database URI")
+    parser.add_argument("-t", "--table", required=True, help="The table to show the progress of")
+    parser.add_argument("-s", "--step", default='import', help="The type of work, import or merge")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    pool = DBPool()
+    await pool.connect(args.uri)
+    journal = Journal(pool)
+    await journal.create()
+    if await journal.isDone(args.table, args.step):
+        print(f"The {args.step} of {args.table} is finished")
+    for lower, upper in await journal.getRanges(args.table, args.step):
+        print(f"{lower} to {upper}")
+    await pool.close()
+
+if __name__ == "__main__":
+    """This is just a hook so this file can be run standalone during development."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main())
@@ -0,0 +1,21 @@
+-- The progress of importing and merging data from the Tasking Manager.
+-- Each row is a range of keys that has been committed, so an interrupted
+-- import can be resumed. The lower bound is exclusive, the upper bound
+-- is inclusive. Merges of the aux tables are only recorded when done.
+CREATE TABLE IF NOT EXISTS public.journal (
+    tablename character varying NOT NULL,
+    step character varying NOT NULL,
+    lower bigint[],
+    upper bigint[],
+    records bigint DEFAULT 0,
+    finished timestamp without time zone DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS journal_idx ON public.journal USING btree (tablename, step);
+
+-- The newest value of the watermark column for each TM table at the
+-- last import or sync, so the next sync only reads what has changed.
+CREATE TABLE IF NOT EXISTS public.watermarks (
+    tablename character varying PRIMARY KEY,
+    watermark timestamp without time zone,
+    updated timestamp without time zone DEFAULT now()
+);
@@ -44,8 +44,6 @@ from tm_admin.generator import Generator
 # from osm_rawdata.pgasync import PostgresClient
 import re
 # from progress import Bar, PixelBar
-from tqdm import tqdm
-import tqdm.asyncio
 from codetiming import Timer
 import asyncio
 from tm_admin.pgsupport import PGSupport
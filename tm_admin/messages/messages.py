@@ -27,6 +27,7 @@ from sys import argv
 from datetime import datetime
 from dateutil.parser import parse
 import tm_admin.types_tm
+from tm_admin.schema import getSchema
 from tm_admin.types_tm import Roles, Mappinglevel, Teammemberfunctions
 import concurrent.futures
 from cpuinfo import get_cpu_info
@@ -34,7 +35,6 @@ from tm_admin.dbsupport import DBSupport
 from tm_admin.users.users_class import UsersTable
 from tm_admin.messages.messages_class import MessagesTable
 from osm_rawdata.postgres import uriParser, PostgresClient
-from tqdm import tqdm
 from codetiming import Timer
 import threading
 
@@ -74,7 +74,7 @@ class MessagesDB(DBSupport):
         """
         self.pg = None
         self.profile = MessagesTable()
-        self.types = dir(tm_admin.types_tm)
+        self.types = getSchema().enums
         super().__init__('messages')
 
     def getByFilter(self,
@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetMap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import logging
+import time
+import json
+import asyncio
+from datetime import datetime
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+class Counter(object):
+    def __init__(self,
+                 name: str,
+                 total: int = None,
+                 ):
+        """
+        The progress of one table, like import:users.
+
+        Args:
+            name (str): The name of the table
+            total (int): The number of records expected, if known
+
+        Returns:
+            (Counter): An instance of this class
+        """
+        self.name = name
+        self.total = total
+        self.read = 0
+        self.written = 0
+        self.start = time.perf_counter()
+        self.end = None
+
+    def elapsed(self):
+        """
+        Returns:
+            (float): The seconds since the table was started
+        """
+        end = self.end
+        if end is None:
+            end = time.perf_counter()
+        return end - self.start
+
+    def rate(self):
+        """
+        Returns:
+            (float): The records written per second
+        """
+        elapsed = self.elapsed()
+        if elapsed == 0.0:
+            return 0.0
+        return self.written / elapsed
+
+    def eta(self):
+        """
+        Returns:
+            (float): The seconds left, or None if the total isn't known
+        """
+        rate = self.rate()
+        if self.total is None or rate == 0.0 or self.end is not None:
+            return None
+        return max(self.total - self.written, 0) / rate
+
+    def status(self):
+        """
+        Format the progress of the table as one line.
+
+        Returns:
+            (str): The progress
+        """
+        out = f"{self.name}: read {self.read}, wrote {self.written}"
+        if self.total:
+            out += f" of ~{self.total}"
+        out += f", {self.rate():.0f} records/s"
+        eta = self.eta()
+        if eta is not None:
+            out += f", about {eta:.0f}s left"
+        return out
+
+    def summary(self):
+        """
+        Returns:
+            (dict): The progress of the table
+        """
+        return {"read": self.read,
+                "written": self.written,
+                "total": self.total,
+                "seconds": round(self.elapsed(), 3),
+                "rate": round(self.rate(), 1),
+                "finished": self.end is not None,
+                }
+
+class Progress(object):
+    def __init__(self):
+        """
+        Keep track of the progress of all the tables being imported,
+        merged or synced, instead of each worker having it's own
+        progress bar. The workers just count what they read and write,
+        and the progress of all the tables is logged at once.
+
+        Returns:
+            (Progress): An instance of this class
+        """
+        self.tables = dict()
+        self.start = time.perf_counter()
+        self.started = datetime.now()
+
+    def begin(self,
+              name: str,
+              total: int = None,
+              ):
+        """
+        Start keeping track of a table.
+
+        Args:
+            name (str): The name of the table, like import:users
+            total (int): The number of records expected, if known
+        """
+        self.tables[name] = Counter(name, total)
+
+    def get(self,
+            name: str,
+            ):
+        """
+        Get the counter for a table, starting it if it isn't yet.
+
+        Args:
+            name (str): The name of the table
+
+        Returns:
+            (Counter): The progress of the table
+        """
+        if name not in self.tables:
+            self.begin(name)
+        return self.tables[name]
+
+    def read(self,
+             name: str,
+             records: int,
+             ):
+        """
+        Count the records read for a table.
+
+        Args:
+            name (str): The name of the table
+            records (int): The number of records read
+        """
+        self.get(name).read += records
+
+    def wrote(self,
+              name: str,
+              records: int,
+              ):
+        """
+        Count the records written for a table.
+
+        Args:
+            name (str): The name of the table
+            records (int): The number of records written
+        """
+        self.get(name).written += records
+
+    def finish(self,
+               name: str,
+               ):
+        """
+        Mark a table as done.
+
+        Args:
+            name (str): The name of the table
+        """
+        counter = self.get(name)
+        counter.end = time.perf_counter()
+        log.info(counter.status())
+
+    def status(self):
+        """
+        Format the progress of the tables that are still running.
+
+        Returns:
+            (str): The progress, one line for each table
+        """
+        return "\n".join([counter.status() for counter in self.tables.values() if counter.end is None])
+
+    async def report(self,
+                     interval: float = 10.0,
+                     ):
+        """
+        Log the progress of the tables that are still running every
+        so often. This runs till it's cancelled.
+
+        Args:
+            interval (float): The seconds between reports
+        """
+        while True:
+            await asyncio.sleep(interval)
+            status = self.status()
+            if len(status) > 0:
+                log.info(f"Progress:\n{status}")
+
+    def summary(self,
+                **kwargs,
+                ):
+        """
+        Get the progress of all the tables.
+
+        Args:
+            kwargs: Anything else to add to the summary
+
+        Returns:
+            (dict): The summary
+        """
+        out = {"started": self.started.isoformat(timespec='seconds'),
+               "seconds": round(time.perf_counter() - self.start, 3),
+               "tables": {name: counter.summary() for name, counter in self.tables.items()},
+               }
+        out.update(kwargs)
+        return out
+
+    def write(self,
+              filespec: str,
+              **kwargs,
+              ):
+        """
+        Write the summary to a JSON file.
+
+        Args:
+            filespec (str): The file to write
+            kwargs: Anything else to add to the summary
+        """
+        with open(filespec, 'w') as file:
+            json.dump(self.summary(**kwargs), file, indent=4)
+        log.info(f"Wrote {filespec}")
+
+# All the tables being processed share the same progress
+progress = Progress()
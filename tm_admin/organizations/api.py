@@ -36,8 +36,6 @@ from tm_admin.organizations.organizations_class import OrganizationsTable
 from tm_admin.dbsupport import DBSupport
 from tm_admin.types_tm import Organizationtype
 # from osm_rawdata.pgasync import PostgresClient
-from tqdm import tqdm
-import tqdm.asyncio
 from codetiming import Timer
 import asyncio
 from tm_admin.pgsupport import PGSupport
@@ -27,11 +27,11 @@ from sys import argv
 from datetime import datetime
 from dateutil.parser import parse
 import tm_admin.types_tm
+from tm_admin.schema import getSchema
 from tm_admin.dbsupport import DBSupport
+from tm_admin.dbpool import DBPool
 from tm_admin.organizations.organizations_class import OrganizationsTable
 from osm_rawdata.pgasync import PostgresClient
-from tqdm import tqdm
-import tqdm.asyncio
 from codetiming import Timer
 import asyncio
 
@@ -53,7 +53,7 @@ class OrganizationsDB(DBSupport):
         """
         self.pg = None
         self.profile = OrganizationsTable()
-        self.types = dir(tm_admin.types_tm)
+        self.types = getSchema().enums
         super().__init__('organizations')
 
     async def mergeManagers(self,
@@ -61,24 +61,47 @@ class OrganizationsDB(DBSupport):
                         ):
         """
         A method to merge the contents of the TM organisation_managers into
-        the orgsanizations table as an array.
+        the orgsanizations table as an array. Each organization is
+        written once, with all of it's managers.
 
         Args:
             inpg (PostgresClient): The input database
         """
-        # FIXME: this is a weird table, and only has 4 entries, none of which appear
-        # to be in the other tables, so nothing updates.
         table = 'organisation_managers'
-        sql = f"SELECT * FROM {table} ORDER BY organisation_id"
-        # print(sql)
-        result = await inpg.execute(sql)
+        stages = [(f"tm_{table}",
+                   "organisation_id int, user_id bigint",
+                   f"SELECT organisation_id, user_id FROM {table}"),
+                  ]
+        sql = f"""UPDATE organizations SET managers = s.managers
+            FROM (SELECT organisation_id, array_agg(user_id ORDER BY user_id) AS managers
+                FROM tm_{table} GROUP BY organisation_id) AS s
+            WHERE organizations.id = s.organisation_id"""
+        await self.mergeStaged(inpg, stages, [sql])
+
+        return True
+
+    async def mergeAuxTables(self,
+                             inuri: str,
+                             outuri: str,
+                             pool: DBPool = None,
+                             resume: bool = False,
+                             ):
+        """
+        Merge more tables from TM into the unified organizations table.
+
+        Args:
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
+        """
+        await self.connect(outuri)
+        await self.connectPool(outuri, pool, resume)
+
+        inpg = PostgresClient()
+        await inpg.connect(inuri)
 
-        data = dict()
-        pbar = tqdm.tqdm(result)
-        for record in result:
-            sql = f" UPDATE organizations SET managers = managers||{record['user_id']} WHERE id={record['organisation_id']};"
-            print(sql)
-            await self.pg.execute(sql)
+        await self.mergeStep('organisation_managers', self.mergeManagers, inpg)
 
 async def main():
     """This main function lets this class be run standalone by a bash script."""
@@ -107,14 +130,9 @@ async def main():
         stream=sys.stdout,
     )
 
-    inpg = PostgresClient()
-    await inpg.connect(args.inuri)
-
     org = OrganizationsDB()
-    await org.connect(args.outuri)
+    await org.mergeAuxTables(args.inuri, args.outuri)
 
-    await org.mergeManagers(inpg)
-            
 if __name__ == "__main__":
     """This is just a hook so this file can be run standalone during development."""
     loop = asyncio.new_event_loop()
@@ -27,15 +27,19 @@ import time
 from io import BytesIO
 from pathlib import Path
 from urllib.parse import urlparse
+import json
+from enum import Enum
+from dateutil.parser import parse
 import asyncpg
 import asyncio
 import geojson
 import tm_admin.types_tm
 from osm_rawdata.pgasync import PostgresClient
-from tm_admin.yamlfile import YamlFile
+from tm_admin.schema import getSchema, yaml2py
 from tm_admin.projects.projects_class import ProjectsTable
 from tm_admin.projects.projects_teams_class import Projects_teamsTable
 from shapely.geometry import Polygon, Point, shape
+from shapely import wkb
 # from tm_admin.projects.projects_teams_class import Projects_teamsTable
 # from tm_admin.teams.teams_members_class import Teams_membersTable
 
@@ -47,6 +51,102 @@ rootdir = tma.__path__[0]
 log = logging.getLogger(__name__)
 
 
+def encodeJson(value):
+    """
+    Encode a value for a json or jsonb column. The values from toValue()
+    are already a JSON string, so those are passed through.
+
+    Args:
+        value: The value for the column
+
+    Returns:
+        (str): The JSON string
+    """
+    if type(value) == str:
+        return value
+    return json.dumps(value, default=lambda val: val.name if isinstance(val, Enum) else str(val))
+
+def encodeGeometry(value):
+    """
+    Encode a shapely geometry as EWKB for a geometry column.
+
+    Args:
+        value: The geometry, or WKB that is passed through
+
+    Returns:
+        (bytes): The EWKB for the geometry
+    """
+    if type(value) == bytes:
+        return value
+    return wkb.dumps(value, srid=4326)
+
+def enumCodec(tmtype):
+    """
+    Create the functions to convert between a postgres enum and one of
+    the Enums in types_tm.py.
+
+    Args:
+        tmtype (IntEnum): The Enum class from types_tm.py
+
+    Returns:
+        (function, function): The encoder and decoder for the enum
+    """
+    def encoder(value):
+        if isinstance(value, Enum):
+            return value.name
+        elif type(value) == int:
+            return tmtype(value).name
+        return value
+
+    def decoder(value):
+        if value not in tmtype.__members__:
+            raise ValueError(f"'{value}' isn't in {tmtype.__name__}, types_tm.py is out of date with the database")
+        return tmtype[value]
+
+    return encoder, decoder
+
+async def initCodecs(con: asyncpg.Connection):
+    """
+    Setup the codecs for a connection, so the query results are already
+    converted to python. The json and jsonb columns become a dict or list,
+    the enums become the Enum from types_tm.py, and PostGIS geometries
+    become shapely geometries.
+
+    Args:
+        con (asyncpg.Connection): The database connection
+    """
+    for datatype in ('json', 'jsonb'):
+        await con.set_type_codec(datatype,
+                                 schema='pg_catalog',
+                                 encoder=encodeJson,
+                                 decoder=json.loads,
+                                 format='text',
+                                 )
+
+    sql = "SELECT t.typname FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace WHERE t.typtype = 'e' AND n.nspname = 'public'"
+    for record in await con.fetch(sql):
+        tmtype = getSchema().enums.get(record['typname'].capitalize())
+        if tmtype is None:
+            continue
+        encoder, decoder = enumCodec(tmtype)
+        await con.set_type_codec(record['typname'],
+                                 schema='public',
+                                 encoder=encoder,
+                                 decoder=decoder,
+                                 format='text',
+                                 )
+
+    try:
+        await con.set_type_codec('geometry',
+                                 schema='public',
+                                 encoder=encodeGeometry,
+                                 decoder=wkb.loads,
+                                 format='binary',
+                                 )
+    except ValueError:
+        # The postgis extension isn't in this database
+        log.debug("No geometry type in the database")
+
 class PGSupport(PostgresClient):
     def __init__(self,
                  table: str = None,
@@ -54,27 +154,39 @@ class PGSupport(PostgresClient):
         super().__init__()
         self.table = None
         self.yaml = None
+        self.yaml2py = yaml2py
+        self.types = dict()
+        self.columns = dict()
         if table:
-            self.yaml = YamlFile(f"{rootdir}/{table}/{table}.yaml")
+            # The schema is shared, so this doesn't read any files
             self.table = table
-        self.yaml2py = {'int32': 'int',
-                    'int64': 'int',
-                    'bool': 'bool',
-                    'string': 'str',
-                    'bytes': 'bytes',
-                    'timestamp': 'timestamp without time zone',
-                    'polygon': 'Polygon',
-                    'point': 'Point',
-                    'json': 'dict',
-                    }
-        self.types = dict()
+            self.types = getSchema().getTypes(table)
+            self.columns = getSchema().getColumns(table)
+        # The prepared statements, and the connection they're for
+        self.statements = dict()
+        self.prepared = None
+
+    async def connect(self,
+                      dburi: str,
+                      ):
+        """
+        Connect to the database, and setup the codecs so the data is
+        converted when it's read, instead of later.
+
+        Args:
+            dburi (str): The URI string for the database connection
+        """
+        await super().connect(dburi)
+        if self.pg is not None:
+            await initCodecs(self.pg)
 
     async def getTypes(self,
 #                      uri: str,
                       table: str = None,
                       ):
         """
-        Get all the columns and datatypes from the config file.
+        Get all the columns and datatypes from the schema, which is only
+        read from the config files once for each process.
 
         Args:
             uri (str): The URI for the TM Admin database
@@ -83,145 +195,269 @@ class PGSupport(PostgresClient):
         # await self.connect(uri)
         if table:
             self.table = table
-        filespec = Path(f"{rootdir}/{self.table}/{self.table}.yaml")
-        self.yaml = YamlFile(filespec)
-        self.types = dict()
-        for entry in self.yaml.yaml:
-            [[table, settings]] = entry.items()
-            for item in settings:
-                if type(item) == dict:
-                    [[k, v]] = item.items()
-                    if v[0] in self.yaml2py:
-                        datatype = self.yaml2py[v[0]]
-                    else:
-                        # it's an SQL Enum from types_tm.py
-                        datatype = v[0]
-                    if type(v) == list:
-                        for element in v:
-                            if 'array' in element:
-                                if element['array']:
-                                    datatype += "[]"
-                self.types[k] = datatype 
+        self.types = getSchema().getTypes(self.table)
+        self.columns = getSchema().getColumns(self.table)
+
+    def toValue(self,
+                key: str,
+                value,
+                ):
+        """
+        Convert a value to what asyncpg wants for the datatype of the
+        column it's for, so it can be passed as a parameter instead of
+        being quoted in the SQL.
+
+        Args:
+            key (str): The column name
+            value: The value for the column
+
+        Returns:
+            The value to pass to postgres
+        """
+        datatype = self.types[key]
+        if value is None:
+            return None
+        if datatype[:7] == "public.":
+            # The enums may be the Enum, the string value, or the integer value
+            tmtype = self.columns[key].enum
+            def toName(val):
+                if isinstance(val, Enum):
+                    return val.name
+                elif type(val) == int:
+                    return tmtype(val).name
+                return val
+            if datatype[-2:] == "[]":
+                if type(value) not in (list, tuple, set):
+                    value = [value]
+                return [toName(val) for val in value]
+            return toName(value)
+        elif datatype[-2:] == "[]":
+            if type(value) not in (list, tuple, set):
+                return [value]
+            return list(value)
+        elif datatype == "int":
+            if type(value) == str:
+                return int(value)
+        elif datatype == "bool":
+            if type(value) == str:
+                return value.lower() == "true"
+            return bool(value)
+        elif datatype[:9] == "timestamp":
+            if type(value) == str:
+                return parse(value)
+        elif datatype in ("Polygon", "Point"):
+            if type(value) != str:
+                return value.wkt
+        elif datatype in ("jsonb", "dict"):
+            if type(value) != str:
+                # The IntEnums would otherwise be written as the integer
+                def toNames(val):
+                    if isinstance(val, Enum):
+                        return val.name
+                    elif type(val) == dict:
+                        return {k: toNames(v) for k, v in val.items()}
+                    elif type(val) in (list, tuple):
+                        return [toNames(v) for v in val]
+                    return val
+                return json.dumps(toNames(value), default=str)
+        return value
+
+    def getWhere(self,
+                 where: dict,
+                 start: int = 1,
+                 ):
+        """
+        Create the WHERE clause for a query with parameters for the values.
+
+        Args:
+            where (dict): The conditions to limit the records
+            start (int): The number of the first parameter
+
+        Returns:
+            (str, list): The WHERE clause, and the values for the parameters
+        """
+        if not where:
+            return "", list()
+        tests = list()
+        args = list()
+        for key, value in where.items():
+            if key not in self.types:
+                raise ValueError(f"There is no '{key}' column in the {self.table} table")
+            if value == 'null':
+                tests.append(f"{key} IS NOT NULL")
+            elif type(value) == dict:
+                # It's a query including a jsonb column
+                for k1, v1 in value.items():
+                    # teams->'teams' @? '$[*] ? (@.role == "VALIDATOR")'
+                    # The enums in a jsonb column are stored as the name
+                    if isinstance(v1, Enum):
+                        v1 = v1.name
+                    tests.append(f"{key}->'{key}' @? ${start + len(args)}::jsonpath")
+                    args.append(f"$[*] ? (@.{k1} == {json.dumps(v1)})")
+            else:
+                tests.append(f"{key} = ${start + len(args)}")
+                args.append(self.toValue(key, value))
+
+        return f" WHERE {' AND '.join(tests)}", args
+
+    async def prepare(self,
+                      sql: str,
+                      ):
+        """
+        Get the prepared statement for a query. Each query is only
+        prepared once for each connection, so postgres doesn't have to
+        parse and plan it again when the same query is used with
+        different values.
+
+        Args:
+            sql (str): The SQL query, using $1, $2, etc... for the parameters
+
+        Returns:
+            (PreparedStatement): The prepared statement for this connection
+        """
+        # The prepared statements only work with the connection they're from
+        if self.prepared is not self.pg:
+            self.statements = dict()
+            self.prepared = self.pg
+        if sql not in self.statements:
+            self.statements[sql] = await self.pg.prepare(sql)
+
+        return self.statements[sql]
+
+    async def query(self,
+                    sql: str,
+                    *args,
+                    ):
+        """
+        Run a parameterized query using the cached prepared statement.
+
+        Args:
+            sql (str): The SQL query, using $1, $2, etc... for the parameters
+            args: The values for the parameters
+
+        Returns:
+            (list): The results of the query
+        """
+        try:
+            statement = await self.prepare(sql)
+            return await statement.fetch(*args)
+        except Exception as e:
+            log.error(f"Couldn't execute query! {e}\n{sql}")
+            return list()
 
     async def deleteRecords(self,
                            record_ids: list,
                            ):
         """
-        Delete a record from a database table.
+        Delete records from a database table with a single query.
 
         Args:
-            record_id (list): The record IDs to delete
+            record_ids (list): The record IDs to delete
 
         Returns:
-            (bool): Whether the record got deleted from the database
+            (bool): Whether any records got deleted from the database
         """
         # log.warning(f"--- deleteRecord(): ---")
         if not self.table:
             log.error(f"Not connected to the database!")
             return False
 
-        for id in record_ids:
-            sql = f"DELETE FROM {self.table} WHERE id={id}"
-            # print(sql)
-            result = await self.execute(sql)
+        sql = f"DELETE FROM {self.table} WHERE id = ANY($1) RETURNING id"
+        result = await self.query(sql, list(record_ids))
+
+        return len(result) > 0
+
+    def getInsert(self,
+                  keys: tuple,
+                  rows: int,
+                  ):
+        """
+        Create the query to insert several records that have values for
+        the same columns.
+
+        Args:
+            keys (tuple): The columns that have values
+            rows (int): The number of records
 
-        return True
+        Returns:
+            (str): The INSERT query
+        """
+        if len(keys) == 0:
+            return f"INSERT INTO {self.table} DEFAULT VALUES RETURNING id"
+
+        values = list()
+        for row in range(0, rows):
+            params = list()
+            for column, key in enumerate(keys):
+                param = f"${(row * len(keys)) + column + 1}"
+                if self.types[key] in ("Polygon", "Point"):
+                    params.append(f"ST_GeomFromText({param}, 4326)")
+                elif self.types[key] == "jsonb":
+                    params.append(f"{param}::jsonb")
+                else:
+                    params.append(param)
+            values.append(f"({', '.join(params)})")
+
+        return f"INSERT INTO {self.table}({', '.join(keys)}) VALUES{', '.join(values)} RETURNING id"
 
     async def insertRecords(self,
                            records: list,
                            ):
         """
-        Insert a record in a database table. All the primary tables auto-increment
+        Insert records in a database table. All the primary tables auto-increment
         the id column. If id is set in the record, then it uses that value, otherwise
-        it increments.
+        it increments. The records that have values for the same columns are
+        inserted with a single query, and either all the records get inserted,
+        or none of them do.
 
         Args:
-            records (dict): The record data
+            records (list): The Table classes with the record data
 
         Returns:
-            (bool): Whether the record got inserted into the database
+            (list): The id of each record, in the same order as the records
         """
         # log.warning(f"--- insertRecords(): ---")
         if not self.table:
             log.error(f"Not connected to the database!")
-            return False
+            return list()
 
-        data = dict()
-        jcol = dict()
-        for entry in records:
+        # Group the records by the columns they have values for, as
+        # those can all go in the same query.
+        shapes = dict()
+        for index, entry in enumerate(records):
+            keys = list()
+            args = list()
             for key, value in entry.data.items():
                 if key not in self.types:
                     log.error(f"You need to update types_tm.py for {key}!")
-                    breakpoint()
-                val = self.types[key]
-                # print(type(val), value)
+                    return list()
                 if not value:
                     continue
-                if type(value) == list:
-                    fo = str(value)
-                    data[key] = f"XARRAY{str(value)}X"
-                elif type(value) == dict:
-                    # It's for a jsonb column
-                    # a dict uses single quotes, postgres wants double quotes.
-                    # newval = str(value).replace("'", '"')
-                    for entry in value[key]:
-                        for k, v in entry.items():
-                            if str(type(v))[:5] == "<enum":
-                                jcol[k] = v.name
-                            else:
-                                jcol[k] = v
-                    # print(jcol)
-                    # continue
-                # This is a bit ugly. When passing a geometry we need to get rid of the
-                # double quote around this value.
-                elif val == "bool":
-                    if value == True:
-                        data[key] = f"true"
-                    else:
-                        data[key] = f"false"
-                elif val == "Polygon":
-                    data[key] = f"XST_GeomFromText('{value}')X"
-                elif val == "Point":
-                    data[key] = f"XST_GeomFromText('{value}')X"
-                elif val[:7] == "public.":
-                    # FIXME: unfortunately, the supposed enums are a mix of
-                    # the string value or the integer value. Ideally this should
-                    # all get cleaned up, but till then handle both.
-                    # print(f"FIXME: {key}: {type(value)}")
-                    tmtype = val[7:].capitalize()
-                    if type(value) == str:
-                        data[key] = value
-                    elif type(value) == int:
-                        # All we have is the value,             so instantiate the Enum
-                        # to get the name. Also check if it's an array.
-                        if tmtype[-2:] == "[]":
-                            obj = eval("tm_admin.types_tm.%s(%s)" % (tmtype[:-2], value))
-                            data[key] = "{%s}" % obj.name
-                        else:
-                            obj = eval(f"tm_admin.types_tm.{tmtype}({value})")
-                            data[key] = obj.name
-                else:
-                    data[key] = value
-
-            keys = str(list(data.keys())).replace("'", "")[1:-1]
-            # This is a bit ugly. When passing a geometry we need to get rid of the
-            # double quote around this value.
-            values = str(list(data.values()))[1:-1]
-            # FIXME: dealing with quoting between python and postgres is a hassle
-            foo = values.replace('"X', "").replace('X"', "")
-            # print(f"1: {foo}")
-            foo = foo.replace("'X", "").replace("X'", "")
-            # print(f"2: {foo}")
-            sql = f"INSERT INTO {self.table}({keys}) VALUES({foo}) RETURNING id"
-            # print(sql)
-            result = await self.execute(sql)
-            # print(result)
-
-        if len(result) > 0:
-            return result[0]['id']
-        else:
+                keys.append(key)
+                args.append(self.toValue(key, value))
+            shapes.setdefault(tuple(keys), list()).append((index, args))
+
+        ids = [None] * len(records)
+        try:
+            async with self.pg.transaction():
+                for keys, entries in shapes.items():
+                    # Postgres is limited to 32767 parameters in a query
+                    rows = 1
+                    if len(keys) > 0:
+                        rows = max(min(1000, 32767 // len(keys)), 1)
+                    for start in range(0, len(entries), rows):
+                        chunk = entries[start:start + rows]
+                        statement = await self.prepare(self.getInsert(keys, len(chunk)))
+                        result = await statement.fetch(*[arg for index, args in chunk for arg in args])
+                        # The ids are returned in the same order as the VALUES
+                        for (index, args), record in zip(chunk, result):
+                            ids[index] = record['id']
+        except Exception as e:
+            log.error(f"Couldn't insert the records! {e}")
             return list()
 
+        return ids
+
     async def updateColumns(self,
                            columns: dict,
                            where: dict = None,
@@ -241,54 +477,129 @@ class PGSupport(PostgresClient):
             log.error(f"Not connected to the database!")
             return False
 
-        check = str()
-        if where:
-            check = "WHERE "
-            for k, v in where.items():
-                if v == 'null':
-                    check += f"{k} IS NOT NULL "
-                else:
-                    check += f"{k}={v} "
-                if len(where) > 1:
-                    check += "AND"
-
-        sql = f"UPDATE {self.table} SET "
+        sets = list()
+        args = list()
         for key, value in columns.items():
+            if key not in self.types:
+                log.error(f"There is no '{key}' column in the {self.table} table")
+                return 0
             val = self.types[key]
-            if val[:7] == "public.":
-                # It's an enum
-                tmtype = val[7:].capitalize()
-                obj = eval(f"tm_admin.types_tm.{tmtype}({value})")
-                sql += f"{key} = '{obj.name}', "
-            elif val[-2:] == "[]":
-                sql += "%s = %s||ARRAY%s, " % (key, key, str(value))
+            if val[-2:] == "[]":
+                # Arrays get appended to
+                args.append(self.toValue(key, value))
+                sets.append(f"{key} = {key}||${len(args)}")
             elif val == "jsonb":
                 # A jsonb column may contain enums
-                data = dict()
-                for k, v in value.items():
-                    if str(type(v))[:5] == "<enum":
-                        data[k] = v.name
-                    else:
-                        data[k] = v
-                # data += "}"
-                values = str(data).replace("'", '"')
-                sql += "%s = '{" % key
-                sql += f"\"{key}\": [{values}]"
-                sql += "}'"
+                args.append(self.toValue(key, {key: [value]}))
+                sets.append(f"{key} = ${len(args)}::jsonb")
+            elif val in ("Polygon", "Point"):
+                args.append(self.toValue(key, value))
+                sets.append(f"{key} = ST_GeomFromText(${len(args)}, 4326)")
             else:
-                sql += f"{key} = {value}, "
+                args.append(self.toValue(key, value))
+                sets.append(f"{key} = ${len(args)}")
 
-        if sql[-2:] == ", ":
-            query = sql[:-2] + f" {check} RETURNING id"
-        else:
-            query = sql + f" {check} RETURNING id"
-        # print(query)
-        result = await self.execute(query.replace(", WHERE", " WHERE"))
+        try:
+            check, params = self.getWhere(where, len(args) + 1)
+        except ValueError as e:
+            log.error(e)
+            return 0
+
+        sql = f"UPDATE {self.table} SET {', '.join(sets)}{check} RETURNING id"
+        result = await self.query(sql, *args, *params)
         if len(result) > 0:
             return result[0]['id']
         else:
             return 0
 
+    def getUpdate(self,
+                  keys: tuple,
+                  columns: tuple,
+                  ):
+        """
+        Create the query to update many records, each with it's own
+        values. The values for each column are passed as an array, and
+        unnest() turns them back into rows to join with the table.
+
+        Args:
+            keys (tuple): The columns that identify each record
+            columns (tuple): The columns to update
+
+        Returns:
+            (str): The UPDATE query
+        """
+        sqltypes = {'int': 'bigint',
+                    'bool': 'boolean',
+                    'str': 'text',
+                    'bytes': 'bytea',
+                    'dict': 'json',
+                    'Polygon': 'text',
+                    'Point': 'text',
+                    }
+        arrays = list()
+        for index, key in enumerate(keys + columns):
+            datatype = self.types[key]
+            arrays.append(f"${index + 1}::{sqltypes.get(datatype, datatype)}[]")
+
+        sets = list()
+        for key in columns:
+            if self.types[key] in ("Polygon", "Point"):
+                sets.append(f"{key} = ST_GeomFromText(updates.{key}, 4326)")
+            else:
+                sets.append(f"{key} = updates.{key}")
+        check = ' AND '.join([f"{self.table}.{key} = updates.{key}" for key in keys])
+
+        sql = f"UPDATE {self.table} SET {', '.join(sets)}"
+        sql += f" FROM unnest({', '.join(arrays)}) AS updates({', '.join(keys + columns)})"
+        sql += f" WHERE {check} RETURNING {self.table}.id"
+
+        return sql
+
+    async def updateRecords(self,
+                            records: list,
+                            keys: tuple = ("id",),
+                            ):
+        """
+        Update many records with a single query, each with it's own
+        values. Unlike updateColumns(), array columns aren't appended
+        to, the new value replaces the old one.
+
+        Args:
+            records (list): A dict of the columns and their new values for each record
+            keys (tuple): The columns that identify each record
+
+        Returns:
+            (list): The ids of the records that got updated
+        """
+        if not self.table:
+            log.error(f"Not connected to the database!")
+            return list()
+        if len(records) == 0:
+            return list()
+
+        keys = tuple(keys)
+        columns = tuple([key for key in records[0].keys() if key not in keys])
+        for key in keys + columns:
+            if key not in self.types:
+                log.error(f"There is no '{key}' column in the {self.table} table")
+                return list()
+            if self.types[key][-2:] == "[]":
+                # unnest() would flatten an array of arrays
+                log.error(f"Can't update the '{key}' array column for many records at once")
+                return list()
+
+        args = list()
+        for key in keys + columns:
+            try:
+                args.append([self.toValue(key, record[key]) for record in records])
+            except KeyError:
+                log.error(f"All the records need a value for '{key}'")
+                return list()
+
+        result = await self.query(self.getUpdate(keys, columns), *args)
+
+        return [record['id'] for record in result]
+
     async def resetSequence(self):
         """
         Reset the ID column sequence to zero.
@@ -333,43 +644,24 @@ class PGSupport(PostgresClient):
         Returns:
             (list): The data for this column
         """
-        get = str(columns)[1:-1].replace("'", "")
-
-        check = str()
-        # FIXME: maybe there needs to be an AND in here ?
-        if where:
-            for k, v in where.items():
-                if str(type(v))[:5] == "<enum":
-                    check = f" {k} = '{v.name}'"
-                elif type(v) == dict:
-                    # It's a query including a jsonb column
-                    for k1, v1 in v.items():
-                        # teams->'teams' @? '$[*] ? (@.role == 1)
-                        # FIXME: is it an internal Enum ?
-                        check = f"{k}->'{k}' @? '$[*] ? (@.{k1} == {v1})'"
-                        continue
-                elif v == 'null':
-                    check = f"{k} IS NOT NULL"
-                elif len(check) == 0:
-                    check = f"{k}={v}"
-            sql = f"SELECT {get} FROM {self.table} WHERE {check}"
-        else:
-            sql = f"SELECT {get} FROM {self.table}"
+        for column in columns:
+            if column != '*' and column not in self.types:
+                log.error(f"There is no '{column}' column in the {self.table} table")
+                return list()
+        get = ', '.join(columns)
+
+        try:
+            check, args = self.getWhere(where)
+        except ValueError as e:
+            log.error(e)
+            return list()
+        sql = f"SELECT {get} FROM {self.table}{check}"
         # print(sql)
-        results = await self.execute(sql)
-
-        data = list()
-        for record in results:
-            # print(record)
-            entry = dict()
-            for key, value in record.items():
-                if type(value) == str and value[0] == "{":
-                    entry[key] = eval(value)
-                else:
-                    entry[key] = value
-            data.append(entry)
+        results = await self.query(sql, *args)
 
-        return data
+        # The codecs have already converted the jsonb columns, enums
+        # and geometries.
+        return [dict(record) for record in results]
 
     async def updateJsonb(self,
                             history: list,
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetMap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import logging
+import time
+import asyncio
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+class Stage(object):
+    def __init__(self,
+                 name: str,
+                 ):
+        """
+        The counters for one stage of a pipeline.
+
+        Args:
+            name (str): The name of the stage
+
+        Returns:
+            (Stage): An instance of this class
+        """
+        self.name = name
+        self.batches = 0
+        self.records = 0
+        # The time spent working, not waiting on a queue
+        self.busy = 0.0
+
+    def add(self,
+            records: int,
+            elapsed: float,
+            ):
+        """
+        Count a batch processed by this stage.
+
+        Args:
+            records (int): The number of records in the batch
+            elapsed (float): The time it took
+        """
+        self.batches += 1
+        self.records += records
+        self.busy += elapsed
+
+    def rate(self):
+        """
+        Returns:
+            (float): The records per second while the stage was busy
+        """
+        if self.busy == 0.0:
+            return 0.0
+        return self.records / self.busy
+
+class Queue(asyncio.Queue):
+    def __init__(self,
+                 name: str,
+                 maxsize: int,
+                 ):
+        """
+        A bounded queue between two stages of a pipeline, that keeps
+        track of how full it gets. A queue that is always full means
+        the stage after it is the bottleneck, and one that is always
+        empty means the stage before it is.
+
+        Args:
+            name (str): The name of the queue
+            maxsize (int): The number of batches it can hold
+
+        Returns:
+            (Queue): An instance of this class
+        """
+        super().__init__(maxsize)
+        self.name = name
+        self.samples = 0
+        self.total = 0
+        self.deepest = 0
+
+    async def put(self,
+                  item,
+                  ):
+        """
+        Add a batch to the queue, waiting if it's full.
+
+        Args:
+            item: The batch to add
+        """
+        await super().put(item)
+        depth = self.qsize()
+        self.samples += 1
+        self.total += depth
+        self.deepest = max(self.deepest, depth)
+
+    def average(self):
+        """
+        Returns:
+            (float): The average number of batches in the queue
+        """
+        if self.samples == 0:
+            return 0.0
+        return self.total / self.samples
+
+class Pipeline(object):
+    def __init__(self,
+                 name: str,
+                 depth: int = 2,
+                 ):
+        """
+        A pipeline that reads batches of records, transforms them, and
+        writes them with several writers at once. The stages are
+        connected by bounded queues, so writing starts as soon as the
+        first batch is read, and no more than a few batches are ever
+        in memory no matter how big the table is.
+
+        Args:
+            name (str): The name of the pipeline, usually the table
+            depth (int): The number of batches each queue can hold
+
+        Returns:
+            (Pipeline): An instance of this class
+        """
+        self.name = name
+        self.depth = max(depth, 1)
+        self.stages = {"read": Stage("read"),
+                       "transform": Stage("transform"),
+                       "write": Stage("write"),
+                       }
+        self.queues = list()
+        self.wall = 0.0
+
+    async def run(self,
+                  reader,
+                  transform,
+                  writer,
+                  writers: int = 1,
+                  ):
+        """
+        Run the pipeline till the reader has no more batches, and they
+        have all been written. If any stage fails, the others are
+        cancelled and the exception is raised.
+
+        Args:
+            reader (async iterator): Yields each batch of records
+            transform (function): Converts a batch, or None to pass it through
+            writer (function): The async function that writes a batch
+            writers (int): The number of writers to run at once
+
+        Returns:
+            (int): The number of records written
+        """
+        writers = max(writers, 1)
+        transformed = Queue("transform", self.depth)
+        written = Queue("write", self.depth * writers)
+        self.queues = [transformed, written]
+        start = time.perf_counter()
+
+        async def read():
+            begin = time.perf_counter()
+            async for batch in reader:
+                self.stages['read'].add(len(batch), time.perf_counter() - begin)
+                await transformed.put(batch)
+                begin = time.perf_counter()
+            await transformed.put(None)
+
+        async def convert():
+            while True:
+                batch = await transformed.get()
+                if batch is None:
+                    break
+                begin = time.perf_counter()
+                if transform is not None:
+                    batch = transform(batch)
+                self.stages['transform'].add(len(batch), time.perf_counter() - begin)
+                await written.put(batch)
+            # Tell each writer there is no more data
+            for _ in range(0, writers):
+                await written.put(None)
+
+        async def write():
+            while True:
+                batch = await written.get()
+                if batch is None:
+                    break
+                begin = time.perf_counter()
+                await writer(batch)
+                self.stages['write'].add(len(batch), time.perf_counter() - begin)
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(read())
+                tg.create_task(convert())
+                for _ in range(0, writers):
+                    tg.create_task(write())
+        except ExceptionGroup as group:
+            # Raise the error from the stage that failed, not the group
+            raise group.exceptions[0]
+
+        self.wall = time.perf_counter() - start
+        log.debug(self.summary())
+
+        return self.stages['write'].records
+
+    def summary(self):
+        """
+        Format the throughput of each stage, and how full the queues
+        between them got.
+
+        Returns:
+            (str): The pipeline summary
+        """
+        rate = 0.0
+        if self.wall > 0.0:
+            rate = self.stages['write'].records / self.wall
+        out = f"Pipeline {self.name} took {self.wall:.1f}s, {rate:.0f} records/s\n"
+        for stage in self.stages.values():
+            out += f"    {stage.name:<10} {stage.records:>10} records in {stage.batches} batches, {stage.rate():.0f} records/s busy {stage.busy:.1f}s\n"
+        for queue in self.queues:
+            out += f"    queue to {queue.name:<10} average depth {queue.average():.1f}, deepest {queue.deepest} of {queue.maxsize}\n"
+
+        return out
@@ -35,17 +35,15 @@ from shapely import centroid
 from tm_admin.types_tm import Mappingtypes, Projectstatus, Taskcreationmode, Editors, Permissions, Projectpriority, Projectdifficulty
 from tm_admin.projects.projects_class import ProjectsTable
 from tm_admin.tasks.tasks_class import TasksTable
-from shapely import wkb, get_coordinates
+from shapely import get_coordinates
 from tm_admin.pgsupport import PGSupport
 from osm_rawdata.pgasync import PostgresClient
 import re
 from tm_admin.access import Roles
 # from progress import Bar, PixelBar
-from tqdm import tqdm
-import tqdm.asyncio
 from codetiming import Timer
 import asyncio
-from shapely import wkb, wkt
+from shapely import wkt
 import tm_admin
 
 from cpuinfo import get_cpu_info
@@ -123,22 +121,20 @@ class ProjectsAPI(PGSupport):
         #data = await self.getColumns(['id', 'teams'], where)
         # The role is in a list of dicts in a jsonb column.
 
-        sql = f"SELECT jsonb_path_query(members, '$.members[*] ? (@.team_id[*] == {team_id})') AS results FROM projects WHERE id = {project_id};"
+        sql = "SELECT jsonb_path_query(members, '$.members[*] ? (@.team_id[*] == $team_id)', jsonb_build_object('team_id', $1::bigint)) AS results FROM projects WHERE id = $2"
         # print(sql)
-        results = await self.execute(sql)
+        results = await self.query(sql, team_id, project_id)
 
-        # There should only be one item in the results. Since it's a jsonb column
-        # the data is returned as a string. In the string is an enum value, which
-        # gets converted to the actual enum for Teamrole.
+        # There should only be one item in the results. The jsonb column
+        # is already a dict, with the name of the enum for the role.
         if len(results) > 0:
-            if results[0]['results'][0] == '{':
-                tmp1 = eval(results[0]['results'])
-                tmp2 = f"Roles.{tmp1['role']}"
-                role = eval(tmp2)
-                return role
+            role = results[0]['results']['role']
+            if type(role) == int:
+                return Roles(role)
+            return Roles[role]
 
         # we should never get here, but you never know...
-            return None
+        return None
 
     async def getByName(self,
                         name: str,
@@ -336,8 +332,8 @@ class ProjectsAPI(PGSupport):
         # log.warning(f"getAOI(): Unimplemented!")
         data = await self.getColumns(['geometry'],  {"id": project_id})
 
-        # Convert the WKB to a Polygon.
-        return wkb.loads(data[0]['geometry'])
+        # The geometry is already a Polygon
+        return data[0]['geometry']
 
     async def getDailyContributions(self,
                                project_id: int,
@@ -27,21 +27,20 @@ from sys import argv
 from datetime import datetime
 from dateutil.parser import parse
 import tm_admin.types_tm
+from tm_admin.schema import getSchema
 import geojson
-from cpuinfo import get_cpu_info
 from shapely.geometry import shape
 from shapely import centroid
 from tm_admin.types_tm import Mappingtypes, Projectstatus, Taskcreationmode, Editors, Permissions, Projectpriority, Projectdifficulty, Roles
 from tm_admin.projects.projects_class import ProjectsTable
 from shapely import wkb, get_coordinates
 from tm_admin.dbsupport import DBSupport
+from tm_admin.dbpool import DBPool
 from tm_admin.generator import Generator
 from osm_rawdata.pgasync import PostgresClient
 from tm_admin.access import Roles
 import re
 # from progress import Bar, PixelBar
-from tqdm import tqdm
-import tqdm.asyncio
 from codetiming import Timer
 import asyncio
 from tm_admin.yamlfile import YamlFile
@@ -50,30 +49,70 @@ from tm_admin.yamlfile import YamlFile
 import tm_admin as tma
 rootdir = tma.__path__[0]
 
-# The number of threads is based on the CPU cores
-info = get_cpu_info()
-cores = info["count"] * 2
-
 # Instantiate logger
 log = logging.getLogger(__name__)
 
-async def updateThread(
-    queries: list,
-    db: PostgresClient,
-):
-    """Thread to handle importing data
+# The users that are managers or admins in TM
+managersSelect = "SELECT id FROM users WHERE role > 0"
+
+def teamsSelect(table: str,
+                where: str = "true",
+                ):
+    """
+    Create the query that builds the teams for each project as a jsonb
+    array. The roles in TM are different than TM Admin, and sometimes
+    the role wasn't set. This is used by both the merge and the sync.
 
     Args:
-        queries (list): The list of SQL queries to execute
-        db (PostgresClient): A database connection
+        table (str): The project_teams table
+        where (str): The condition to limit the records
+
+    Returns:
+        (str): The SELECT query
     """
-    pbar = tqdm.tqdm(queries)
-    # for sql in queries:
-    for sql in pbar:
-        # print(sql)
-        result = await db.execute(sql)
+    return f"""SELECT project_id, jsonb_agg(jsonb_build_object('role',
+            CASE role WHEN 1 THEN '{Roles.VALIDATOR.name}' WHEN 2 THEN '{Roles.PROJECT_MANAGER.name}' ELSE '{Roles.READ_ONLY.name}' END,
+            'team_id', team_id) ORDER BY team_id) AS teams
+        FROM {table} WHERE {where} GROUP BY project_id"""
+
+def allowedSelect(table: str,
+                  managers: str,
+                  where: str = "true",
+                  ):
+    """
+    Create the query that builds the allowed users for each project as
+    a jsonb array with their role. This is used by both the merge and
+    the sync.
+
+    Args:
+        table (str): The project_allowed_users table, aliased as a
+        managers (str): The table or subquery with the managers from managersSelect
+        where (str): The condition to limit the records
+
+    Returns:
+        (str): The SELECT query
+    """
+    return f"""SELECT a.project_id, jsonb_agg(jsonb_build_object('user_id', a.user_id, 'role',
+            CASE WHEN m.id IS NULL THEN '{Roles.MAPPER.name}' ELSE '{Roles.PROJECT_MANAGER.name}' END)
+            ORDER BY a.user_id) AS users
+        FROM {table} a LEFT JOIN {managers} m ON m.id = a.user_id WHERE {where} GROUP BY a.project_id"""
+
+def updateMembers(key: str,
+                  source: str,
+                  ):
+    """
+    Create the UPDATE that replaces the teams or the users in the members
+    column of each project, without changing the other one.
+
+    Args:
+        key (str): The key in the members column, teams or users
+        source (str): The table or subquery with a column named the same as the key
 
-    return True
+    Returns:
+        (str): The UPDATE query
+    """
+    return f"""UPDATE projects SET members = COALESCE(projects.members, '{{}}'::jsonb) || jsonb_build_object('{key}', s.{key})
+        FROM {source} AS s WHERE projects.id = s.project_id"""
 
 class ProjectsDB(DBSupport):
     def __init__(self,
@@ -90,7 +129,7 @@ class ProjectsDB(DBSupport):
         """
         self.pg = None
         self.profile = ProjectsTable()
-        self.types = dir(tm_admin.types_tm)
+        self.types = getSchema().enums
         super().__init__('projects')
 
     async def mergeInfo(self,
@@ -111,47 +150,18 @@ class ProjectsDB(DBSupport):
         # print(sql)
         result = await inpg.execute(sql)
 
-        # pbar = tqdm.tqdm(result)
-        queries = list()
+        rows = list()
         for record in result:
-            # in Postgres, to escape a single quote, you use two single quotes. So
-            # we have to fix this before encoding it.
-            if record['name']:
-                name = record['name'].replace("'", "''").encode('utf-8')
-            if record['description']:
-                description = record['description'].replace("'", "''").encode('utf-8')
-            else:
-                description = "NULL".encode('utf-8')
-            if record['short_description']:
-                short = record['short_description'].replace("'", "''").encode('utf-8')
-            else:
-                short = "NULL".encode('utf-8')
-            if record['per_task_instructions']:
-                task = record['per_task_instructions'].replace("'", "''").encode('utf-8')
-            else:
-                task = "NULL".encode('utf-8')
-            if record['instructions']:
-                instructions = record['instructions'].replace("'", "''").encode('utf-8')
-            else:
-                instructions = "NULL".encode('utf-8')
-            # sql = f"UPDATE projects SET id={record['project_id']}, default_locale='{record['locale']}', name={name},short_description={short},description={description},instructions={instructions},per_task_instructions={task} WHERE id={record['project_id']};"
-            sql = f"UPDATE projects SET name='{name.decode('utf-8')}', short_description='{short.decode('utf-8')}', description='{description.decode('utf-8')}', instructions='{instructions.decode('utf-8')}' WHERE id={record['project_id']};"
-            # await self.pg.execute(sql)
-            queries.append(sql)
-
-        entries = len(queries)
-        chunk = round(entries / cores)
-
-        #pbar = tqdm.tqdm(queries)
-        # FIXME: It'd be nice if we could have a progress meter that works with range
-        log.warning(f"This makes take time, so please wait...")
-        async with asyncio.TaskGroup() as tg:
-            for block in range(0, entries, chunk):
-                outpg = PostgresClient()
-                await outpg.connect('localhost/tm_admin')
-                # log.debug(f"Dispatching thread {block}:{block + chunk}")
-                # await updateThread(queries, outpg)
-                task = tg.create_task(updateThread(queries[block:block + chunk], outpg))
+            rows.append((record['name'],
+                         record['short_description'],
+                         record['description'],
+                         record['instructions'],
+                         record['per_task_instructions'],
+                         record['project_id'],
+                         ))
+
+        sql = "UPDATE projects SET name = $1, short_description = $2, description = $3, instructions = $4, per_task_instructions = $5 WHERE id = $6"
+        await self.updateMany(sql, rows)
         timer.stop()
         return True
 
@@ -169,32 +179,11 @@ class ProjectsDB(DBSupport):
         # print(sql)
         result = await inpg.execute(sql)
 
-        entries = len(result)
-        log.debug(f"There are {entries} entries in {table}")
-        chunk = round(entries / cores)
-        # pbar = tqdm.tqdm(result)
+        log.debug(f"There are {len(result)} entries in {table}")
 
-        queries = list()
-        for record in result:
-            pid = record.get('project_id')
-            sql = f" UPDATE projects SET interests = {record['interest_id']} WHERE id={pid}"
-            #print(sql)
-            queries.append(sql)
-            #result = await self.pg.execute(sql)
-
-        entries = len(queries)
-        chunk = round(entries / cores)
-
-        #pbar = tqdm.tqdm(queries)
-        # FIXME: It'd be nice if we could have a progress meter that works with range
-        log.warning(f"This makes take time, so please wait...")
-        async with asyncio.TaskGroup() as tg:
-            for block in range(0, entries, chunk):
-                outpg = PostgresClient()
-                await outpg.connect('localhost/tm_admin')
-                # log.debug(f"Dispatching thread {block}:{block + chunk}")
-                # await updateThread(queries, outpg)
-                task = tg.create_task(updateThread(queries[block:block + chunk], outpg))
+        rows = [(record['interest_id'], record['project_id']) for record in result]
+        sql = "UPDATE projects SET interests = $1 WHERE id = $2"
+        await self.updateMany(sql, rows)
 
         timer.stop()
         return True
@@ -202,6 +191,8 @@ class ProjectsDB(DBSupport):
     async def mergeAuxTables(self,
                              inuri: str,
                              outuri: str,
+                             pool: DBPool = None,
+                             resume: bool = False,
                              ):
         """
         Merge more tables from TM into the unified projects table.
@@ -209,23 +200,26 @@ class ProjectsDB(DBSupport):
         Args:
             inuri (str): The input database
             outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
         """
         await self.connect(outuri)
+        await self.connectPool(outuri, pool, resume)
 
         inpg = PostgresClient()
         await inpg.connect(inuri)
 
-        await self.mergeAllowed(inpg)
+        await self.mergeStep('project_allowed_users', self.mergeAllowed, inpg)
 
-        await self.mergeTeams(inpg)
+        await self.mergeStep('project_teams', self.mergeTeams, inpg)
 
-        await self.mergeInfo(inpg)
+        await self.mergeStep('project_info', self.mergeInfo, inpg)
 
-        await self.mergeChat(inpg)
+        await self.mergeStep('project_chat', self.mergeChat, inpg)
 
-        await self.mergeInterests(inpg)
+        await self.mergeStep('project_interests', self.mergeInterests, inpg)
 
-        await self.mergePriorities(inpg)
+        await self.mergeStep('project_priority_areas', self.mergePriorities, inpg)
 
         # The project favorites table is imported into the users table instead.
         # await self.mergeFavorites(inpg)
@@ -243,29 +237,17 @@ class ProjectsDB(DBSupport):
         sql = f"SELECT * FROM project_chat ORDER BY project_id"
         # print(sql)
         result = await inpg.execute(sql)
-        data = dict()
-        queries = list()
-        for record in tqdm.tqdm(result):
-            # The messages has embedded quotes.
-            message = record['message'].replace("'", "&apos;")
-            sql = f" INSERT INTO chat(id, project_id, user_id, time_stamp, message) VALUES({record['id']}, {record['project_id']}, {record['user_id']}, '{record['time_stamp']}', '{message}')"
-            # print(sql)
-            queries.append(sql)
-            #result = await self.pg.execute(sql)
-
-        entries = len(queries)
-        chunk = round(entries / cores)
-
-        #pbar = tqdm.tqdm(queries)
-        # FIXME: It'd be nice if we could have a progress meter that works with range
-        log.warning(f"This makes take time, so please wait...")
-        async with asyncio.TaskGroup() as tg:
-            for block in tqdm.tqdm(range(0, entries, chunk)):
-                outpg = PostgresClient()
-                await outpg.connect('localhost/tm_admin')
-                # log.debug(f"Dispatching thread {block}:{block + chunk}")
-                # await updateThread(queries, outpg)
-                task = tg.create_task(updateThread(queries[block:block + chunk], outpg))
+        rows = list()
+        for record in result:
+            rows.append((record['id'],
+                         record['project_id'],
+                         record['user_id'],
+                         record['time_stamp'],
+                         record['message'],
+                         ))
+
+        sql = "INSERT INTO chat(id, project_id, user_id, time_stamp, message) VALUES($1, $2, $3, $4, $5)"
+        await self.updateMany(sql, rows, (0,))
 
         timer.stop()
         return True
@@ -273,77 +255,29 @@ class ProjectsDB(DBSupport):
     async def mergeTeams(self,
                         inpg: PostgresClient,
                         ):
+        """
+        Merge the TM project_teams table into the members column of
+        the projects table, as a jsonb array of the teams and their
+        role. The TM table is staged, and the array for each project
+        built with jsonb_agg(), so each project gets updated once.
+
+        Args:
+            inpg (PostgresClient): The input database
+        """
         table = "project_teams"
-        log.error(f"mergeTeams() Unimplemented!")
         timer = Timer(initial_text=f"Merging {table} table...",
                       text="merging table took {seconds:.0f}s",
                       logger=log.debug,
                     )
         log.info(f"Merging {table} table...")
         timer.start()
-        sql = f"SELECT * FROM {table} ORDER BY project_id"
-        # print(sql)
-        result = await inpg.execute(sql)
-
-        entries = len(result)
-        log.debug(f"There are {entries} entries in {table}")
-        chunk = round(entries / cores)
-        # pbar = tqdm.tqdm(result)
-
-        # yaml = YamlFile(f"{rootdir}/projects/projects_teams.yaml")
-        # for variable in yaml.yaml[0]['project_teams']:
-        #     for k, v in variable.items():
-        #         # It's one of our Enums used in a jsonb column
-        #         if v[:7] == "public.":
-
-        # postgres could return this as an array, but we'd still have to process it
-        # to create the SQL query, instead we build an array of teams for each
-        # project, which becomes a nice clean way to add an array.
-        teams = dict()
-        for record in result:
-            if record['role'] < 0:
-                role = Roles(Roles.READ_ONLY)
-            else:
-                if record['role'] == 0:
-                    role = Roles(Roles.READ_ONLY)
-                elif record['role'] == 1:
-                    role = Roles(Roles.VALIDATOR)
-                elif record['role'] == 2:
-                    role = Roles(Roles.PROJECT_MANAGER)
-            if record['project_id'] not in teams:
-                teams[record['project_id']] = [{"role": role.name,
-                                            "team_id": record['team_id']}]
-            else:
-                teams[record['project_id']].append({"role": role.name,
-                                        "team_id": record['team_id']})
-        queries = list()
-        for project, members in teams.items():
-            # Sometimes the role wasn't set
-            try:
-                role = Roles(record['role'])
-            except:
-                role = Roles(1)
-
-            # sql = "UPDATE projects SET teams=teams||'{\"team_id\": %s, \"role\": %s}' WHERE id=%d" % (record['team_id'], role, pid)
-            # Note that this will replace any existing values for this column
-            asc = str(members).replace("'", '"').replace("\\'", "'")
-            sql = "UPDATE projects SET members = '{\"teams\": %s}' WHERE id=%d;" % (asc, project)
-            # print(sql)
-            queries.append(sql)
-            #result = await self.pg.execute(sql)
-
-        entries = len(queries)
-        chunk = round(entries / cores)
-        #pbar = tqdm.tqdm(queries)
-        # FIXME: It'd be nice if we could have a progress meter that works with range
-        log.warning(f"This makes take time, so please wait...")
-        async with asyncio.TaskGroup() as tg:
-            for block in range(0, entries, chunk):
-                outpg = PostgresClient()
-                await outpg.connect('localhost/tm_admin')
-                # log.debug(f"Dispatching thread {block}:{block + chunk}")
-                # await updateThread(queries, outpg)
-                task = tg.create_task(updateThread(queries[block:block + chunk], outpg))
+        stages = [(f"tm_{table}",
+                   "project_id int, team_id int, role int",
+                   f"SELECT project_id, team_id, role FROM {table}"),
+                  ]
+        # This only replaces the teams, not the users in the members column.
+        sql = updateMembers('teams', f"({teamsSelect(f'tm_{table}')})")
+        await self.mergeStaged(inpg, stages, [sql])
 
         timer.stop()
         return True
@@ -353,6 +287,15 @@ class ProjectsDB(DBSupport):
     async def mergeAllowed(self,
                         inpg: PostgresClient,
                         ):
+        """
+        Merge the TM project_allowed_users table into the members
+        column of the projects table, as a jsonb array of the users
+        and their role. The users that are managers or admins in TM
+        are staged along with the table, since there are very few.
+
+        Args:
+            inpg (PostgresClient): The input database
+        """
         table = "project_allowed_users"
         timer = Timer(initial_text=f"Merging {table} table...",
                       text="merging table took {seconds:.0f}s",
@@ -360,44 +303,16 @@ class ProjectsDB(DBSupport):
                     )
         log.info(f"Merging {table} table...")
         timer.start()
-        # Get all the users that are managers or admins. Luckily this
-        # has very few results
-        sql = f"SELECT json_agg(tmp) FROM (SELECT id,role FROM users WHERE role>0) AS tmp;"
-        # print(sql)
-        result = await inpg.execute(sql)
-        admins = dict()
-        for entry in eval(result[0]['json_agg']):
-            admins[entry['id']] = Roles(Roles.PROJECT_MANAGER)
-        # It's faster to do this in Python than postgres
-        # sql = f"SELECT u.user_id,(SELECT ARRAY(SELECT c.project_id FROM {table} c WHERE c.user_id = u.user_id)) AS projects FROM {table} u;"
-        sql = f"SELECT * FROM project_allowed_users ORDER BY project_id"
-        # print(sql)
-        result = await inpg.execute(sql)
-        data = dict()
-        for record in result:
-            if not record['project_id'] in data:
-                entry = list()
-                data[record['project_id']] = entry
-                if record['user_id'] in admins:
-                    role = admins[record['user_id']]
-                else:
-                    role = Roles(Roles.MAPPER)
-                entry.append({"user_id": record['user_id'],
-                              "role": role.name})
-
-        entries = len(result)
-        log.debug(f"There are {entries} entries in {table}, and {len(data)} in the array")
-        chunk = round(entries / cores)
-        # This table has a small amount of data, so threading would be overkill.
-        # for record in pbar:
-        for pid, array in tqdm.tqdm(data.items()):
-            # user = {"user_id": }
-            #sql = f" UPDATE projects SET allowed_users = ARRAY{array} WHERE id={pid}"
-            asc = str(entry).replace("'", '"').replace("\\'", "'")
-            sql = "UPDATE projects SET members = '{\"users\": %s}' WHERE id=%d;" % (asc, pid)
-
-            # print(sql)
-            result = await self.pg.execute(sql)
+        stages = [(f"tm_{table}",
+                   "project_id int, user_id bigint",
+                   f"SELECT project_id, user_id FROM {table}"),
+                  ("tm_managers",
+                   "id bigint",
+                   managersSelect),
+                  ]
+        # This only replaces the users, not the teams in the members column.
+        sql = updateMembers('users', f"({allowedSelect(f'tm_{table}', 'tm_managers')})")
+        await self.mergeStaged(inpg, stages, [sql])
 
         timer.stop()
         return True
@@ -424,15 +339,10 @@ class ProjectsDB(DBSupport):
                 data[record['project_id']] = entry
             entry.append(record['priority_area_id'])
 
-        entries = len(result)
-        log.debug(f"There are {entries} entries in {table}, and {len(data)} in the array")
-        chunk = round(entries / cores)
-        # This table has a small amount of data, so threading would be overkill.
-        # for record in pbar:
-        for pid, array in tqdm.tqdm(data.items()):
-            sql = f" UPDATE projects SET priority_areas = ARRAY{array} WHERE id={pid}"
-            # print(sql)
-            result = await self.pg.execute(sql)
+        log.debug(f"There are {len(result)} entries in {table}, and {len(data)} in the array")
+        rows = [(array, pid) for pid, array in data.items()]
+        sql = "UPDATE projects SET priority_areas = $1 WHERE id = $2"
+        await self.updateMany(sql, rows)
 
         timer.stop()
         return True
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetMap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import logging
+import time
+import asyncio
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+class Scheduler(object):
+    def __init__(self,
+                 jobs: int = 4,
+                 ):
+        """
+        Run the import and merge of the tables concurrently, while
+        making sure a table isn't started till all the tables it
+        depends on are done. The number of tables processed at once
+        is limited, as they all share the pool of database connections.
+
+        Args:
+            jobs (int): The number of tables to process at once
+
+        Returns:
+            (Scheduler): An instance of this class
+        """
+        self.jobs = max(jobs, 1)
+        self.tasks = dict()
+        self.timing = dict()
+        self.start = 0.0
+        self.wall = 0.0
+
+    def add(self,
+            name: str,
+            func,
+            *args,
+            depends: list = list(),
+            ):
+        """
+        Add a job to the schedule.
+
+        Args:
+            name (str): The name of the job, like import:users
+            func (function): The async method to run
+            args: The parameters for the method
+            depends (list): The names of the jobs that have to finish first
+        """
+        self.tasks[name] = {"func": func,
+                            "args": args,
+                            "depends": list(depends),
+                            }
+
+    def getDepends(self,
+                   name: str,
+                   ):
+        """
+        Get the dependencies of a job that are in this schedule. A
+        dependency that isn't scheduled is assumed to already be done,
+        like a merge run without the import.
+
+        Args:
+            name (str): The name of the job
+
+        Returns:
+            (list): The names of the jobs it depends on
+        """
+        return [depend for depend in self.tasks[name]['depends'] if depend in self.tasks]
+
+    def order(self):
+        """
+        Sort the jobs so each one comes after all of it's dependencies.
+
+        Returns:
+            (list): The names of the jobs in order
+        """
+        result = list()
+        state = dict()
+        def visit(name):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f"There is a dependency loop with '{name}'")
+            state[name] = 'visiting'
+            for depend in self.getDepends(name):
+                visit(depend)
+            state[name] = 'done'
+            result.append(name)
+
+        for name in self.tasks:
+            visit(name)
+
+        return result
+
+    async def run(self):
+        """
+        Run all the jobs. Each one waits for it's dependencies, and then
+        for a free slot.
+        """
+        # Check for loops before starting anything
+        self.order()
+        self.timing = dict()
+        done = {name: asyncio.Event() for name in self.tasks}
+        slots = asyncio.Semaphore(self.jobs)
+        self.start = time.perf_counter()
+
+        async def worker(name):
+            for depend in self.getDepends(name):
+                await done[depend].wait()
+            async with slots:
+                log.info(f"Starting {name}")
+                begin = time.perf_counter()
+                task = self.tasks[name]
+                await task['func'](*task['args'])
+                end = time.perf_counter()
+            self.timing[name] = (begin - self.start, end - begin)
+            log.info(f"Finished {name} in {end - begin:.1f}s")
+            done[name].set()
+
+        async with asyncio.TaskGroup() as tg:
+            for name in self.tasks:
+                tg.create_task(worker(name))
+
+        self.wall = time.perf_counter() - self.start
+
+    def criticalPath(self):
+        """
+        Find the chain of dependencies that took the longest. This is
+        the shortest the whole run could take, no matter how many jobs
+        are run at once.
+
+        Returns:
+            (list, float): The names of the jobs on the path, and the total time
+        """
+        total = dict()
+        previous = dict()
+        for name in self.order():
+            total[name] = self.timing[name][1]
+            previous[name] = None
+            for depend in self.getDepends(name):
+                if total[depend] + self.timing[name][1] > total[name]:
+                    total[name] = total[depend] + self.timing[name][1]
+                    previous[name] = depend
+
+        if len(total) == 0:
+            return list(), 0.0
+
+        name = max(total, key=total.get)
+        length = total[name]
+        path = list()
+        while name:
+            path.insert(0, name)
+            name = previous[name]
+
+        return path, length
+
+    def summary(self):
+        """
+        Format the timing for all the jobs.
+
+        Returns:
+            (str): The timing summary
+        """
+        out = "Job                                  Start   Time\n"
+        for name, (begin, elapsed) in sorted(self.timing.items(), key=lambda item: item[1][0]):
+            out += f"{name:<35} {begin:7.1f}s {elapsed:6.1f}s\n"
+        path, length = self.criticalPath()
+        busy = sum([elapsed for begin, elapsed in self.timing.values()])
+        out += f"Critical path: {' -> '.join(path)} took {length:.1f}s\n"
+        out += f"Wall time: {self.wall:.1f}s, total time of all jobs: {busy:.1f}s\n"
+
+        return out
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetMap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import logging
+import threading
+from enum import Enum
+from pathlib import Path
+from collections import namedtuple
+from types import MappingProxyType
+import tm_admin.types_tm
+from tm_admin.yamlfile import YamlFile
+
+import tm_admin as tma
+rootdir = tma.__path__[0]
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+# The python datatype for each datatype in the yaml config files
+yaml2py = {'int32': 'int',
+           'int64': 'int',
+           'bool': 'bool',
+           'string': 'str',
+           'bytes': 'bytes',
+           'timestamp': 'timestamp without time zone',
+           'polygon': 'Polygon',
+           'point': 'Point',
+           'json': 'dict',
+           }
+
+# A column of a table. The datatype is the same string PGSupport has
+# always used, like int, public.mappinglevel, or int[] for an array.
+Column = namedtuple("Column", ["name", "datatype", "enum", "array"])
+
+class Schema(object):
+    def __init__(self,
+                 tables: dict,
+                 ):
+        """
+        The columns of all the tables, from the yaml config files. This
+        can't be changed once it's created, so it can be shared by every
+        API and DB class.
+
+        Args:
+            tables (dict): The columns for each table
+
+        Returns:
+            (Schema): An instance of this class
+        """
+        self.tables = MappingProxyType({table: MappingProxyType(columns) for table, columns in tables.items()})
+        self.types = MappingProxyType({table: MappingProxyType({name: column.datatype for name, column in columns.items()}) for table, columns in tables.items()})
+        # All the Enums in types_tm.py, by class name
+        self.enums = MappingProxyType({name: value for name, value in vars(tm_admin.types_tm).items() if type(value) == type(Enum) and issubclass(value, Enum)})
+
+    def getColumns(self,
+                   table: str,
+                   ):
+        """
+        Args:
+            table (str): The table name
+
+        Returns:
+            (MappingProxyType): The Column for each column name
+        """
+        return self.tables[table]
+
+    def getTypes(self,
+                 table: str,
+                 ):
+        """
+        Args:
+            table (str): The table name
+
+        Returns:
+            (MappingProxyType): The datatype for each column name
+        """
+        return self.types[table]
+
+def parseColumns(filespec: Path):
+    """
+    Read the columns from a yaml config file. If the file has more than
+    one table, all their columns are included.
+
+    Args:
+        filespec (Path): The yaml config file
+
+    Returns:
+        (dict): The Column for each column name
+    """
+    yaml = YamlFile(filespec)
+    columns = dict()
+    for entry in yaml.yaml:
+        [[table, settings]] = entry.items()
+        for item in settings:
+            if type(item) != dict:
+                continue
+            [[k, v]] = item.items()
+            if v[0] in yaml2py:
+                datatype = yaml2py[v[0]]
+            else:
+                # it's an SQL Enum from types_tm.py
+                datatype = v[0]
+            enum = None
+            if datatype[:7] == "public.":
+                enum = getattr(tm_admin.types_tm, datatype[7:].capitalize(), None)
+            array = False
+            if type(v) == list:
+                for element in v:
+                    if type(element) == dict and element.get('array'):
+                        array = True
+            if array:
+                datatype += "[]"
+            columns[k] = Column(k, datatype, enum, array)
+
+    return columns
+
+# The schema is only read once for each process
+schema = None
+schemalock = threading.Lock()
+
+def getSchema():
+    """
+    Get the columns of all the tables. The yaml config files are only
+    read the first time this is called. Each table is named by it's yaml
+    file, like users for users/users.yaml.
+
+    Returns:
+        (Schema): The columns of all the tables
+    """
+    global schema
+    if schema is not None:
+        return schema
+    with schemalock:
+        if schema is None:
+            tables = dict()
+            for filespec in sorted(Path(rootdir).glob("*/*.yaml")):
+                tables[filespec.stem] = parseColumns(filespec)
+            schema = Schema(tables)
+            log.debug(f"Read the schema for {len(tables)} tables")
+
+    return schema
@@ -0,0 +1,540 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2024 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetMap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+import argparse
+import logging
+import sys
+import os
+import asyncio
+from codetiming import Timer
+from osm_rawdata.pgasync import PostgresClient
+from tm_admin.dbpool import DBPool
+from tm_admin.journal import getKeys
+from tm_admin.metrics import progress
+from tm_admin.tmdb import TMImport, RowConverter
+from tm_admin.tasks.tasks import issuesSelect, historySelect, invalidationSelect, appendHistory
+from tm_admin.projects.projects import managersSelect, teamsSelect, allowedSelect, updateMembers
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+# The primary TM tables that have a watermark column. The watermark is
+# the newest value of the column, and the filter selects the records
+# changed between the last watermark and the new one. Tasks don't have
+# a timestamp, so any task with new history gets updated. Tables not
+# listed here are small, so are always copied in full.
+primary = {
+    'projects': {
+        'watermark': "SELECT max(last_updated) FROM projects",
+        'filter': "last_updated > $1 AND last_updated <= $2",
+    },
+    'users': {
+        'watermark': "SELECT max(date_registered) FROM users",
+        'filter': "date_registered > $1 AND date_registered <= $2",
+    },
+    'messages': {
+        'watermark': "SELECT max(date) FROM messages",
+        'filter': "date > $1 AND date <= $2",
+    },
+    'tasks': {
+        'watermark': "SELECT max(action_date) FROM task_history",
+        'filter': "(project_id, id) IN (SELECT project_id, task_id FROM task_history WHERE action_date > $1 AND action_date <= $2)",
+    },
+}
+
+# The aux TM tables that get folded into arrays or jsonb columns by the
+# mergeAuxTables() methods. The select aggregates the rows on the TM
+# side, these are copied into a staging table in TM Admin, and then
+# the update applies them with a single statement. History is appended,
+# so it's only done when there is a watermark, everything else replaces
+# the existing value so can always be done in full. Most of the aux
+# tables don't have a timestamp, so the project ones use the watermark
+# of the projects table. Where the merge builds the same jsonb, the
+# select and update are functions shared with the merge, so a sync
+# always gets the same result as a full merge.
+auxtables = {
+    'task_history': {
+        'target': 'tasks',
+        'append': True,
+        'watermark': "SELECT max(action_date) FROM task_history",
+        'filter': "h.action_date > $1 AND h.action_date <= $2",
+        'select': lambda where: historySelect("task_history", f"({issuesSelect})", where),
+        'stage': "project_id int, task_id bigint, created timestamp, history jsonb",
+        'update': lambda stage: appendHistory(stage, True),
+    },
+    'task_invalidation_history': {
+        'target': 'tasks',
+        'append': True,
+        'watermark': "SELECT max(updated_date) FROM task_invalidation_history",
+        'filter': "updated_date > $1 AND updated_date <= $2",
+        'select': lambda where: invalidationSelect("task_invalidation_history", where),
+        'stage': "project_id int, task_id bigint, history jsonb",
+        'update': lambda stage: appendHistory(stage),
+    },
+    'project_chat': {
+        'target': 'projects',
+        'watermark': "SELECT max(time_stamp) FROM project_chat",
+        'filter': "time_stamp > $1 AND time_stamp <= $2",
+        'select': "SELECT id, project_id, user_id, time_stamp, message FROM project_chat WHERE {filter}",
+        'stage': "id bigint, project_id int, user_id int, time_stamp timestamp, message varchar",
+        'update': """INSERT INTO chat(id, project_id, user_id, time_stamp, message)
+            SELECT id, project_id, user_id, time_stamp, message FROM {stage}
+            ON CONFLICT (id) DO NOTHING""",
+    },
+    'project_info': {
+        'target': 'projects',
+        'watermark': "SELECT max(last_updated) FROM projects",
+        'filter': "project_id IN (SELECT id FROM projects WHERE last_updated > $1 AND last_updated <= $2)",
+        'select': """SELECT DISTINCT ON (project_id) project_id, name, short_description, description, instructions, per_task_instructions
+            FROM project_info WHERE {filter} ORDER BY project_id""",
+        'stage': "project_id int, name varchar, short_description varchar, description varchar, instructions varchar, per_task_instructions varchar",
+        'update': """UPDATE projects SET name = s.name, short_description = s.short_description,
+            description = s.description, instructions = s.instructions, per_task_instructions = s.per_task_instructions
+            FROM {stage} AS s WHERE projects.id = s.project_id""",
+    },
+    'project_interests': {
+        'target': 'projects',
+        'watermark': "SELECT max(last_updated) FROM projects",
+        'filter': "project_id IN (SELECT id FROM projects WHERE last_updated > $1 AND last_updated <= $2)",
+        'select': "SELECT project_id, max(interest_id) AS interests FROM project_interests WHERE {filter} GROUP BY project_id",
+        'stage': "project_id int, interests int",
+        'update': "UPDATE projects SET interests = s.interests FROM {stage} AS s WHERE projects.id = s.project_id",
+    },
+    'project_priority_areas': {
+        'target': 'projects',
+        'watermark': "SELECT max(last_updated) FROM projects",
+        'filter': "project_id IN (SELECT id FROM projects WHERE last_updated > $1 AND last_updated <= $2)",
+        'select': "SELECT project_id, array_agg(priority_area_id ORDER BY priority_area_id) AS priority_areas FROM project_priority_areas WHERE {filter} GROUP BY project_id",
+        'stage': "project_id int, priority_areas bigint[]",
+        'update': "UPDATE projects SET priority_areas = s.priority_areas FROM {stage} AS s WHERE projects.id = s.project_id",
+    },
+    'project_teams': {
+        'target': 'projects',
+        'watermark': "SELECT max(last_updated) FROM projects",
+        'filter': "project_id IN (SELECT id FROM projects WHERE last_updated > $1 AND last_updated <= $2)",
+        'select': lambda where: teamsSelect("project_teams", where),
+        'stage': "project_id int, teams jsonb",
+        'update': lambda stage: updateMembers('teams', stage),
+    },
+    'project_allowed_users': {
+        'target': 'projects',
+        'watermark': "SELECT max(last_updated) FROM projects",
+        'filter': "a.project_id IN (SELECT id FROM projects WHERE last_updated > $1 AND last_updated <= $2)",
+        'select': lambda where: allowedSelect("project_allowed_users", f"({managersSelect})", where),
+        'stage': "project_id int, users jsonb",
+        'update': lambda stage: updateMembers('users', stage),
+    },
+    'user_interests': {
+        'target': 'users',
+        'select': "SELECT user_id, array_agg(interest_id ORDER BY interest_id) AS interests FROM user_interests WHERE {filter} GROUP BY user_id",
+        'stage': "user_id bigint, interests int[]",
+        'update': "UPDATE users SET interests = s.interests FROM {stage} AS s WHERE users.id = s.user_id",
+    },
+    'user_licenses': {
+        'target': 'users',
+        'select': """SELECT "user" AS user_id, array_agg(license ORDER BY license) AS licenses FROM user_licenses WHERE {filter} GROUP BY "user" """,
+        'stage': "user_id bigint, licenses int[]",
+        'update': "UPDATE users SET licenses = s.licenses FROM {stage} AS s WHERE users.id = s.user_id",
+    },
+    'project_favorites': {
+        'target': 'users',
+        'select': "SELECT user_id, array_agg(project_id ORDER BY project_id) AS favorite_projects FROM project_favorites WHERE {filter} GROUP BY user_id",
+        'stage': "user_id bigint, favorite_projects int[]",
+        'update': "UPDATE users SET favorite_projects = s.favorite_projects FROM {stage} AS s WHERE users.id = s.user_id",
+    },
+    'campaign_projects': {
+        'target': 'campaigns',
+        'select': "SELECT campaign_id, array_agg(project_id ORDER BY project_id) AS projects FROM campaign_projects WHERE {filter} GROUP BY campaign_id",
+        'stage': "campaign_id int, projects int[]",
+        'update': "UPDATE campaigns SET projects = s.projects FROM {stage} AS s WHERE campaigns.id = s.campaign_id",
+    },
+    'campaign_organisations': {
+        'target': 'campaigns',
+        'select': "SELECT campaign_id, array_agg(organisation_id ORDER BY organisation_id) AS organizations FROM campaign_organisations WHERE {filter} GROUP BY campaign_id",
+        'stage': "campaign_id int, organizations int[]",
+        'update': "UPDATE campaigns SET organizations = s.organizations FROM {stage} AS s WHERE campaigns.id = s.campaign_id",
+    },
+    'organisation_managers': {
+        'target': 'organizations',
+        'select': "SELECT organisation_id, array_agg(user_id ORDER BY user_id) AS managers FROM organisation_managers WHERE {filter} GROUP BY organisation_id",
+        'stage': "organisation_id int, managers int[]",
+        'update': "UPDATE organizations SET managers = s.managers FROM {stage} AS s WHERE organizations.id = s.organisation_id",
+    },
+    'team_members': {
+        'target': 'teams',
+        'select': """SELECT team_id, jsonb_agg(jsonb_build_object('user_id', user_id,
+            'function', CASE function WHEN 1 THEN 'MANAGER' WHEN 2 THEN 'MEMBER' END,
+            'active', CASE WHEN active THEN 'true' ELSE 'false' END) ORDER BY user_id) AS members
+            FROM team_members WHERE {filter} GROUP BY team_id""",
+        'stage': "team_id int, members jsonb",
+        'update': "UPDATE teams SET team_members = jsonb_build_object('members', s.members) FROM {stage} AS s WHERE teams.id = s.team_id",
+    },
+}
+
+def getQuery(query,
+             **kwargs,
+             ):
+    """
+    Get the SQL for an aux table. This is either a string to format, or
+    for the tables where the merge and the sync share the same SQL, a
+    function that creates it.
+
+    Args:
+        query (str or function): The query from auxtables
+        kwargs: The filter or the stage table for the query
+
+    Returns:
+        (str): The SQL query
+    """
+    if callable(query):
+        return query(*kwargs.values())
+    return query.format(**kwargs)
+
+async def upsertThread(
+        data: list,
+        db: PostgresClient,
+        table: str,
+        converter: RowConverter,
+        ):
+    """
+    Thread to insert or update a batch of records. The records are
+    copied into a temporary table, and then merged into the TM Admin
+    table with a single INSERT ... ON CONFLICT.
+
+    Args:
+        data (list): The list of records to sync
+        db (PostgresClient): A connection from the pool
+        table (str): The TM table being synced
+        converter (RowConverter): The compiled conversion for this table
+    """
+    keys = getKeys(table)
+    if table == 'organisations':
+        table = 'organizations'
+    records = converter.convert(data)
+    columns = ', '.join(converter.columns)
+    # Only update the columns that came from TM, not the defaults
+    # for the required columns that TM doesn't have.
+    update = [f"{column} = EXCLUDED.{column}" for column in converter.columns[:len(converter.plan)] if column not in keys]
+    sql = f"INSERT INTO {table}({columns}) SELECT {columns} FROM sync_{table} ON CONFLICT ({', '.join(keys)}) DO "
+    if len(update) > 0:
+        sql += f"UPDATE SET {', '.join(update)}"
+    else:
+        sql += "NOTHING"
+    async with db.pg.transaction():
+        await db.pg.execute(f"CREATE TEMP TABLE sync_{table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        await db.pg.copy_records_to_table(f"sync_{table}", records=records, columns=converter.columns)
+        await db.pg.execute(sql)
+
+    return True
+
+async def stageThread(
+        data: list,
+        db: PostgresClient,
+        table: str,
+        config: dict,
+        ):
+    """
+    Thread to fold a batch of aggregated records from an aux table into
+    TM Admin. The records are copied into a temporary table, and then
+    applied with a single UPDATE.
+
+    Args:
+        data (list): The list of records from the select for this aux table
+        db (PostgresClient): A connection from the pool
+        table (str): The aux table being synced
+        config (dict): The entry for this aux table in auxtables
+    """
+    stage = f"sync_{table}"
+    columns = [column.split()[0] for column in config['stage'].split(',')]
+    async with db.pg.transaction():
+        await db.pg.execute(f"CREATE TEMP TABLE {stage} ({config['stage']}) ON COMMIT DROP")
+        await db.pg.copy_records_to_table(stage, records=[tuple(record) for record in data], columns=columns)
+        await db.pg.execute(getQuery(config['update'], stage=stage))
+
+    return True
+
+class TMSync(object):
+    def __init__(self,
+                 batch: int = 10000,
+                 ):
+        """
+        This class syncs the changes in a Tasking Manager database since
+        the last import or sync into TM Admin. Each table has a watermark,
+        which is the newest value of a timestamp column, so only the
+        records that are new or changed get read.
+
+        Args:
+            batch (int): The number of records to read at a time, 0 uses the default
+
+        Returns:
+            (TMSync): An instance of this class
+        """
+        # A sync always reads in batches, so reading the entire table
+        # with a batch of 0 uses the default batch size instead.
+        if batch <= 0:
+            batch = 10000
+        # Use the reader from the importer, since it's the same data
+        self.tmi = TMImport(batch)
+        self.pool = None
+        self.journal = None
+
+    async def connect(self,
+                inuri: str,
+                outuri: str,
+                pool: DBPool = None,
+                ):
+        """
+        Connect to both databases.
+
+        Args:
+            inuri (str): The URI for the TM database
+            outuri (str): The URI for the TM Admin database
+            pool (DBPool): The shared pool of connections to the TM Admin database
+        """
+        await self.tmi.connect(inuri, outuri, pool)
+        self.pool = self.tmi.pool
+        self.journal = self.tmi.journal
+
+    async def getWatermark(self,
+                           sql: str,
+                           ):
+        """
+        Get the current value of a watermark from the TM database.
+
+        Args:
+            sql (str): The query for the watermark
+
+        Returns:
+            (datetime): The newest value of the watermark column
+        """
+        return await self.tmi.tmdb.pg.fetchval(sql)
+
+    async def markTables(self,
+                         tables: list,
+                         ):
+        """
+        Save the current watermarks for the primary tables, this is done
+        before importing so the first sync gets anything that changed
+        while the import was running.
+
+        Args:
+            tables (list): The TM Admin tables being imported
+        """
+        for table in tables:
+            if table in primary:
+                watermark = await self.getWatermark(primary[table]['watermark'])
+                await self.journal.setWatermark(table, watermark)
+
+    async def markAuxTables(self,
+                            tables: list,
+                            ):
+        """
+        Save the current watermarks for the aux tables that get merged
+        into the primary tables.
+
+        Args:
+            tables (list): The TM Admin tables being merged into
+        """
+        for name, config in auxtables.items():
+            if config['target'] in tables and 'watermark' in config:
+                watermark = await self.getWatermark(config['watermark'])
+                await self.journal.setWatermark(name, watermark)
+
+    async def getFilter(self,
+                        name: str,
+                        config: dict,
+                        ):
+        """
+        Get the filter for the records changed since the last sync.
+
+        Args:
+            name (str): The name of the table in the watermarks table
+            config (dict): The config with the watermark query and filter
+
+        Returns:
+            (str, list, datetime): The filter, the values for it, and the new watermark
+        """
+        if 'watermark' not in config:
+            return "true", [], None
+        watermark = await self.getWatermark(config['watermark'])
+        previous = await self.journal.getWatermark(name)
+        if previous is None:
+            return "true", [], watermark
+        return config['filter'], [previous, watermark], watermark
+
+    async def syncTable(self,
+                        table: str,
+                        ):
+        """
+        Insert or update the records in a primary table that are new
+        or have changed since the last sync.
+
+        Args:
+            table (str): The TM Admin table to sync
+        """
+        timer = Timer(initial_text=f"Syncing {table} table...",
+                      text="syncing table took {seconds:.0f}s",
+                      logger=log.debug,
+                    )
+        timer.start()
+        await self.tmi.loadConfig(table)
+        config = self.tmi.config
+        tmtable = table
+        if table == 'organizations':
+            tmtable = 'organisations'
+
+        where, args, watermark = await self.getFilter(table, primary.get(table, dict()))
+        if where == "true" and table in primary:
+            log.warning(f"There is no watermark for '{table}', so syncing all of it")
+        columns = await self.tmi.getPlan(tmtable)
+        sql = f"SELECT {', '.join(columns)} FROM {tmtable} WHERE {where}"
+
+        name = f"sync:{table}"
+        progress.begin(name)
+        entries = 0
+        converter = None
+        inflight = asyncio.Semaphore(self.pool.maxsize)
+        async with asyncio.TaskGroup() as tg:
+            async for data in self.tmi.getBatches(sql, *args):
+                if converter is None:
+                    converter = RowConverter(config, list(data[0].keys()))
+                # Don't read the next batch till there is a writer for it
+                await inflight.acquire()
+                entries += len(data)
+                progress.read(name, len(data))
+                tg.create_task(self.writer(inflight, name, upsertThread, data, tmtable, converter))
+
+        if watermark is not None:
+            await self.journal.setWatermark(table, watermark)
+        progress.finish(name)
+        timer.stop()
+        log.info(f"Synced {entries} records into the '{table}' table")
+
+    async def syncAuxTable(self,
+                           table: str,
+                           ):
+        """
+        Fold the records from an aux table that are new or have changed
+        since the last sync into the primary table.
+
+        Args:
+            table (str): The TM aux table to sync
+        """
+        config = auxtables[table]
+        where, args, watermark = await self.getFilter(table, config)
+        if where == "true" and config.get('append', False):
+            # Appending everything would duplicate what was merged
+            log.warning(f"There is no watermark for '{table}', run the merge first")
+            if watermark is not None:
+                await self.journal.setWatermark(table, watermark)
+            return
+
+        sql = getQuery(config['select'], filter=where)
+        name = f"sync:{table}"
+        progress.begin(name)
+        entries = 0
+        inflight = asyncio.Semaphore(self.pool.maxsize)
+        async with asyncio.TaskGroup() as tg:
+            async for data in self.tmi.getBatches(sql, *args):
+                await inflight.acquire()
+                entries += len(data)
+                progress.read(name, len(data))
+                tg.create_task(self.writer(inflight, name, stageThread, data, table, config))
+
+        if watermark is not None:
+            await self.journal.setWatermark(table, watermark)
+        progress.finish(name)
+        log.info(f"Synced {entries} records from the '{table}' table into '{config['target']}'")
+
+    async def writer(self,
+                     inflight: asyncio.Semaphore,
+                     name: str,
+                     func,
+                     data: list,
+                     *args,
+                     ):
+        """
+        Run a worker with a connection from the pool, and then let the
+        reader know it can read another batch.
+
+        Args:
+            inflight (asyncio.Semaphore): Limits the batches in memory
+            name (str): The name to count the records written under
+            func (function): The worker to run
+            data (list): The data for the worker to process
+            args: Any other parameters for the worker
+        """
+        try:
+            await self.pool.run(func, data, *args)
+            progress.wrote(name, len(data))
+        finally:
+            inflight.release()
+
+    async def syncTables(self,
+                         tables: list,
+                         ):
+        """
+        Sync the primary tables, and then the aux tables that get merged
+        into them.
+
+        Args:
+            tables (list): The TM Admin tables to sync
+        """
+        for table in tables:
+            log.info(f"Syncing the '{table}' table")
+            await self.syncTable(table)
+
+        for name, config in auxtables.items():
+            if config['target'] in tables:
+                log.info(f"Syncing the '{name}' table")
+                await self.syncAuxTable(name)
+
+async def main():
+    """This main function lets this class be run standalone by a bash script."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    parser.add_argument("-i", "--inuri", default='localhost/tm4', help="The URI string for the TM database")
+    parser.add_argument("-o", "--outuri", default='localhost/tm_admin', help="The URI string for the TM Admin database")
+    parser.add_argument("-t", "--table", required=True, help="The table to sync")
+    parser.add_argument("-b", "--batch", type=int, default=10000, help="The number of records to read at a time")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    log_level = os.getenv("LOG_LEVEL", default="INFO")
+    if args.verbose is not None:
+        log_level = logging.DEBUG
+
+    logging.basicConfig(
+        level=log_level,
+        format=("%(asctime)s.%(msecs)03d [%(levelname)s] " "%(name)s | %(funcName)s:%(lineno)d | %(message)s"),
+        datefmt="%y-%m-%d %H:%M:%S",
+        stream=sys.stdout,
+    )
+
+    sync = TMSync(args.batch)
+    await sync.connect(args.inuri, args.outuri)
+    await sync.syncTables([args.table])
+
+if __name__ == "__main__":
+    """This is just a hook so this file can be run standalone during development."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(main())
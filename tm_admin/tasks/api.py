@@ -41,8 +41,6 @@ from shapely import wkb, get_coordinates
 from tm_admin.tasks.task_history_class import Task_historyTable
 import re
 # from progress import Bar, PixelBar
-from tqdm import tqdm
-import tqdm.asyncio
 from codetiming import Timer
 import asyncio
 from tm_admin.pgsupport import PGSupport
@@ -29,46 +29,101 @@ from dateutil.parser import parse
 import concurrent.futures
 from tm_admin.types_tm import Taskaction
 from tm_admin.dbsupport import DBSupport
+from tm_admin.dbpool import DBPool
 from tm_admin.tasks.tasks_class import TasksTable
 from tm_admin.tasks.task_history_class import Task_historyTable
 from tm_admin.tasks.task_invalidation_history_class import Task_invalidation_historyTable
 from osm_rawdata.pgasync import PostgresClient
-from tqdm import tqdm
 from codetiming import Timer
 import threading
-from cpuinfo import get_cpu_info
 import psycopg2.extensions
 from dateutil.parser import parse
 import time
-from tqdm import tqdm
-import tqdm.asyncio
 import asyncio
 from codetiming import Timer
 
 # Instantiate logger
 log = logging.getLogger(__name__)
 
-# The number of threads is based on the CPU cores
-info = get_cpu_info()
-cores = info["count"] * 2
+# There can be several mapping issues for a history entry, in which
+# case the last one is used.
+issuesSelect = "SELECT DISTINCT ON (task_history_id) task_history_id, issue, mapping_issue_category_id AS category, count FROM task_mapping_issues ORDER BY task_history_id, id DESC"
 
-async def updateThread(
-    queries: list,
-    db: PostgresClient,
-):
-    """Thread to handle importing data
+def historySelect(history: str,
+                  issues: str,
+                  where: str = "true",
+                  ):
+    """
+    Create the query that builds the history entries for each task as
+    a jsonb array, oldest first. This is used by both the merge and the
+    sync, so they always produce the same history.
 
     Args:
-        queries (list): The list of SQL queries to execute
-        db (PostgresClient): A database connection
+        history (str): The task_history table, aliased as h
+        issues (str): The table or subquery with the mapping issues from issuesSelect
+        where (str): The condition to limit the history entries
+
+    Returns:
+        (str): The SELECT query
+    """
+    return f"""SELECT h.project_id, h.task_id, min(h.action_date) AS created,
+        jsonb_agg(jsonb_strip_nulls(jsonb_build_object(
+            'user_id', h.user_id, 'action', h.action,
+            'action_text', replace(h.action_text, E'\\u00a0', ''),
+            'action_date', to_char(h.action_date, 'YYYY-MM-DD"T"HH24:MI:SS'),
+            'issue', i.issue, 'category', i.category, 'count', i.count))
+            ORDER BY h.action_date, h.id) AS history
+        FROM {history} h LEFT JOIN {issues} i ON i.task_history_id = h.id
+        WHERE {where} GROUP BY h.project_id, h.task_id"""
+
+def invalidationSelect(table: str,
+                       where: str = "true",
+                       ):
     """
-    pbar = tqdm.tqdm(queries)
-    for sql in pbar:
-    # for sql in queries:
-        # print(sql)
-        result = await db.execute(sql)
+    Create the query that builds the invalidation entries for each task
+    as a jsonb array, oldest first. This is used by both the merge and
+    the sync.
 
-    return True
+    Args:
+        table (str): The task_invalidation_history table
+        where (str): The condition to limit the entries
+
+    Returns:
+        (str): The SELECT query
+    """
+    return f"""SELECT project_id, task_id, jsonb_agg(jsonb_strip_nulls(jsonb_build_object(
+            'mapper_id', mapper_id, 'invalidator_id', COALESCE(invalidator_id, 0),
+            'validator_id', COALESCE(validator_id, 0),
+            'mapped_date', to_char(mapped_date, 'YYYY-MM-DD"T"HH24:MI:SS'),
+            'invalidated_date', to_char(invalidated_date, 'YYYY-MM-DD"T"HH24:MI:SS'),
+            'validated_date', to_char(validated_date, 'YYYY-MM-DD"T"HH24:MI:SS'),
+            'updated_date', to_char(updated_date, 'YYYY-MM-DD"T"HH24:MI:SS'),
+            'is_closed', COALESCE(is_closed, false)))
+            ORDER BY updated_date, id) AS history
+        FROM {table} WHERE {where} GROUP BY project_id, task_id"""
+
+def appendHistory(source: str,
+                  created: bool = False,
+                  ):
+    """
+    Create the UPDATE that appends the history entries from a query to
+    the history column of each task.
+
+    Args:
+        source (str): The table or subquery with the entries to append
+        created (bool): Whether the source has the created column from historySelect
+
+    Returns:
+        (str): The UPDATE query
+    """
+    sql = """UPDATE tasks SET history = jsonb_set(COALESCE(tasks.history, '{"history": []}'::jsonb),
+        '{history}', COALESCE(tasks.history->'history', '[]'::jsonb) || s.history)"""
+    if created:
+        # The created column is the first entry in the history
+        sql += ", created = LEAST(tasks.created, s.created)"
+    sql += f" FROM {source} AS s WHERE tasks.id = s.task_id AND tasks.project_id = s.project_id"
+
+    return sql
 
 class TasksDB(DBSupport):
     def __init__(self,
@@ -105,6 +160,8 @@ class TasksDB(DBSupport):
     async def mergeAuxTables(self,
                              inuri: str,
                              outuri: str,
+                             pool: DBPool = None,
+                             resume: bool = False,
                              ):
         """
         Merge more tables from TM into the unified tasks table.
@@ -112,8 +169,11 @@ class TasksDB(DBSupport):
         Args:
             inuri (str): The input database
             outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
         """
         await self.connect(outuri)
+        await self.connectPool(outuri, pool, resume)
 
         inpg = PostgresClient()
         await inpg.connect(inuri)
@@ -121,9 +181,9 @@ class TasksDB(DBSupport):
         # FIXME: in TM, this table is empty
         # await self.mergeAnnotations(inpg)
 
-        await self.mergeHistory(inpg)
+        await self.mergeStep('task_history', self.mergeHistory, inpg)
 
-        await self.mergeInvalidations(inpg)
+        await self.mergeStep('task_invalidation_history', self.mergeInvalidations, inpg)
 
         # This is now handled by mergeHistory
         # await self.mergeIssues(inpg)
@@ -132,8 +192,13 @@ class TasksDB(DBSupport):
                         inpg: PostgresClient,
                         ):
         """
-        A method to merge the contents of the TM campaign_projects into
-        the campaigns table as an array.
+        Merge the TM task_history table into the history column of the
+        tasks table. The history and the mapping issues are staged in
+        TM Admin, and then the history of every task is built as a
+        jsonb array, oldest first, and applied with one UPDATE.
+
+        Args:
+            inpg (PostgresClient): The input database
         """
         table = 'task_history'
         timer = Timer(initial_text=f"Merging {table} table...",
@@ -143,93 +208,35 @@ class TasksDB(DBSupport):
         log.info(f"Merging {table} table...")
         timer.start()
 
-        # There is a small amount of data in this table, and we need to
-        # coorelate it to the task history when merging, so read in
-        # the entire dataset.
-        sql = f"SELECT * FROM task_mapping_issues ORDER BY id;"
-        # print(sql)
-        data = await inpg.execute(sql)
-        entries = len(data)
-        log.debug(f"There are {len(data)} records in task_mapping_issues")
-        issues = dict()
-        # pbar = tqdm.tqdm(data)
-        # for record in pbar:
-        for record in data:
-            hid = record['task_history_id']
-            issues[hid] = {'issue': record['issue'],
-                           'category': record['mapping_issue_category_id'],
-                           'count': record['count'],
-                           }
-
-        # Now get the data from the history table
-        sql = f"SELECT * FROM {table}"
-        # print(sql)
-        data = await inpg.execute(sql)
-        entries = len(data)
-        log.debug(f"There are {len(data)} records in {table}")
-
-        chunk = round(entries/cores)
-
-        # FIXME: create an array of SQL queries, so later we can use
-        # prepared_queries in asyncpg for better performance. We also don't
-        # need all of the columns from the TM table, since task ID and
-        # project ID are already part of the table schema.
-        queries = list()
-        # pbar = tqdm.tqdm(data)
-        #for record in pbar:
-        for record in data:
-            entry = {"user_id": record['user_id']}
-            # entry['action'] = Taskaction(record['action']).name
-            entry['action'] = record['action']
-            # The action_text column often has issues with embedded
-            # quotes.
-            if record['action_text']:
-                fix = record['action_text'].replace('"', '&quot;')
-            entry['action_text'] = fix.replace("'", '&apos;').replace("\xa0", "")
-            if record['action_date']:
-                entry['action_date'] = '{:%Y-%m-%dT%H:%M:%S}'.format(record['action_date'])
-            # If there is an issue, add it to the record in the jsonb column
-            if record['id'] in issues:
-                entry.update(issues[record['id']])
-                entry.update(issues[record['id']])
-                # entry['issue'] = issues['issue']
-                # entry['category'] = issues['category']
-                # entry['count'] = issues['count']
-            asc = str(entry).replace("'", '"').replace("\\'", "'")
-            sql = "UPDATE tasks SET history = '{\"history\": [%s]}' WHERE id=%d AND project_id=%d" % (asc, record['task_id'], record['project_id'])
-            # print(sql)
-            queries.append(sql)
-
-            # Add a timestamp to the created column so this table can
-            # be partitioned.
-            sql = f"UPDATE tasks SET created = '{entry['action_date']}' WHERE id={record['task_id']} AND project_id={record['project_id']}"
-            # print(sql)
-            queries.append(sql)
-
-        entries = len(queries)
-        chunk = round(entries/cores)
-        import copy
-        async with asyncio.TaskGroup() as tg:
-            for block in range(0, entries, chunk):
-                # for index in range(0, cores):
-                outpg = PostgresClient()
-                # FIXME: this should not be hard coded
-                await outpg.connect('localhost/tm_admin')
-                # FIXME: this may be removed after testing, but memory
-                # corruption errors fored this workaround.
-                foo = copy.copy(queries[block:block + chunk -1])
-                log.debug(f"Dispatching thread {block}:{block + chunk - 1}")
-#                await updateThread(foo, outpg)
-                # await updateThread(queries[block:block + chunk], outpg)
-                task = tg.create_task(updateThread(foo, outpg))
+        # We don't need all of the columns from the TM table, since task ID
+        # and project ID are already part of the table schema.
+        stages = [('tm_task_history',
+                   "id bigint, project_id int, task_id bigint, user_id bigint, action varchar, action_text varchar, action_date timestamp",
+                   f"SELECT id, project_id, task_id, user_id, action, action_text, action_date FROM {table}"),
+                  ('tm_task_mapping_issues',
+                   "task_history_id bigint, issue varchar, category int, count int",
+                   issuesSelect),
+                  ]
+
+        # This replaces any existing history, and the created column is
+        # set to the first entry so this table can be partitioned.
+        sql = f"""UPDATE tasks SET history = jsonb_build_object('history', s.history), created = COALESCE(s.created, tasks.created)
+            FROM ({historySelect('tm_task_history', 'tm_task_mapping_issues')}) AS s
+            WHERE tasks.id = s.task_id AND tasks.project_id = s.project_id"""
+
+        await self.mergeStaged(inpg, stages, [sql])
         timer.stop()
 
     async def mergeInvalidations(self,
                         inpg: PostgresClient,
                         ):
         """
-        A method to merge the contents of the TM campaign_projects into
-        the campaigns table as an array.
+        Merge the TM task_invalidation_history table by appending the
+        entries for each task to the history column, after the entries
+        from task_history.
+
+        Args:
+            inpg (PostgresClient): The input database
         """
         table = 'task_invalidation_history'
         timer = Timer(initial_text=f"Merging {table} table...",
@@ -237,57 +244,18 @@ class TasksDB(DBSupport):
                         logger=log.debug,
                     )
         log.info(f"Merging {table} table...")
-
-        sql = f"SELECT * FROM {table} ORDER BY project_id"
-        # print(sql)
         timer.start()
-        data = await inpg.execute(sql)
-        entries = len(data)
-        log.debug(f"There are {entries} records in {table}")
-
-        # FIXME: create an array of SQL queries, so later we can use
-        # prepared_queries in asyncpg for better performance.
-        queries = list()
-        for record in data:
-            tid = record['task_id']
-            entry = {"mapper_id": record['mapper_id']}
-            if record['invalidator_id']:
-                entry['invalidator_id'] = record['invalidator_id']
-            else:
-                entry['invalidator_id'] = 0
-            if record['validator_id']:
-                entry['validator_id'] = record['validator_id']
-            else:
-                entry['validator_id'] = 0
-            if record['mapped_date']:
-                entry['mapped_date'] = '{:%Y-%m-%dT%H:%M:%S}'.format(record['mapped_date'])
-            if record['invalidated_date']:
-                entry['mapped_date'] = '{:%Y-%m-%dT%H:%M:%S}'.format(record['invalidated_date'])
-            if record['validated_date']:
-                entry['mapped_date'] = '{:%Y-%m-%dT%H:%M:%S}'.format(record['validated_date'])
-            if record['updated_date']:
-                entry['mapped_date'] = '{:%Y-%m-%dT%H:%M:%S}'.format(record['updated_date'])
-            if record['is_closed']:
-                entry["is_closed_id"] = "true"
-            else:
-                entry["is_closed_id"] = "false"
-            # entries[record['task_id']].append(entry)
-            asc = str(entry).replace("'", '"').replace("\\'", "'")
-            sql = "UPDATE tasks SET history = '{\"history\": [%s]}' WHERE id=%d AND project_id=%d" % (asc, record['task_id'], record['project_id'])
-            # print(sql)
-            queries.append(sql)
-
-        entries = len(queries)
-        chunk = round(entries / cores)
-        async with asyncio.TaskGroup() as tg:
-            for block in range(0, entries, chunk):
-                # for index in range(0, cores):
-                outpg = PostgresClient()
-                # FIXME: this should not be hard coded
-                await outpg.connect('localhost/tm_admin')
-                log.debug(f"Dispatching thread {block}:{block + chunk}")
-                #await updateThread(queries[block:block + chunk], outpg)
-                task = tg.create_task(updateThread(queries[block:block + chunk], outpg))
+
+        stages = [('tm_task_invalidation_history',
+                   "id bigint, project_id int, task_id bigint, mapper_id bigint, invalidator_id bigint, validator_id bigint, mapped_date timestamp, invalidated_date timestamp, validated_date timestamp, updated_date timestamp, is_closed boolean",
+                   f"SELECT id, project_id, task_id, mapper_id, invalidator_id, validator_id, mapped_date, invalidated_date, validated_date, updated_date, is_closed FROM {table}"),
+                  ]
+
+        sql = appendHistory(f"({invalidationSelect('tm_task_invalidation_history')})")
+
+        # This appends, so the journal has to be updated in the same transaction
+        await self.mergeStaged(inpg, stages, [sql], table)
+        timer.stop()
 
 async def main():
     """This main function lets this class be run standalone by a bash script."""
@@ -27,12 +27,13 @@ from sys import argv
 from datetime import datetime
 from dateutil.parser import parse
 import tm_admin.types_tm
+from tm_admin.schema import getSchema
 
 from tm_admin.dbsupport import DBSupport
+from tm_admin.dbpool import DBPool
 from tm_admin.teams.teams_class import TeamsTable
 from tm_admin.types_tm import Teammemberfunctions
 from osm_rawdata.pgasync import PostgresClient
-import tqdm.asyncio
 import asyncio
 from codetiming import Timer
 
@@ -54,57 +55,68 @@ class TeamsDB(DBSupport):
         """
         self.pg = None
         self.profile = TeamsTable()
-        self.types = dir(tm_admin.types_tm)
+        self.types = getSchema().enums
         super().__init__('teams')
 
     async def mergeTeams(self,
                         inpg: PostgresClient,
                         ):
         """
-        Merge the team_members table.
+        Merge the TM team_members table into the team_members column
+        of the teams table. The TM table is staged, and the members of
+        each team built with jsonb_agg(), so each team gets updated once.
+
+        Args:
+            inpg (PostgresClient): The input database
         """
         table = 'team_members'
-        log.info(f"Merging team members table...")
-        timer = Timer(text="merging team members table took {seconds:.0f}s")
+        timer = Timer(initial_text=f"Merging {table} table...",
+                      text="merging table took {seconds:.0f}s",
+                      logger=log.debug,
+                    )
+        log.info(f"Merging {table} table...")
         timer.start()
-        sql = f"SELECT * FROM {table} ORDER BY user_id"
-        #print(sql)
-        result = await inpg.execute(sql)
-
-        # postgres could return this as an array, but we'd still have to process it
-        # to create the SQL query, instead we build an array of teams for each
-        # project, which becomes a nice clean way to add a array.
-        members = dict() # x{table: list()}
-        for record in result:
-            if record['team_id'] not in members:
-                members[record['team_id']] = list()
-                entry = {"user_id": record['user_id'],
-                        "function": Teammemberfunctions(record['function']).name}
-                if record['active']:
-                    entry["active"] = "true"
-                else:
-                    entry["active"] = "false"
-            members[record['team_id']].append(entry)
-
-        for id, array in tqdm.tqdm(members.items()):
-            # for record in pbar:
-            # func = record['function']
-            # tmfunc = Teammemberfunctions(func)
-            # entry = {"user_id": record['user_id'], "function": tmfunc.name, "active": record['active'] }
-            # members[table].append(entry)
-            # FIXME: do we need join_request_notifications ?
-
-            asc = str(array).replace("'", '"').replace("\\'", "'")
-            # sql = f"UPDATE teams SET team_members = ({record['team_id']}, {record['active']}, '{tmfunc.name}')::team_members WHERE id={record['team_id']}"
-            # sql = f"UPDATE teams SET team_members.team={record['team_id']}, team_members.active={record['active']}, team_members.function='{tmfunc.name}' WHERE id={record['team_id']}"
-            # UPDATE teams SET team_members = '{"13": [{"user_id": 629, "function": 1, "active": true}, {"user_id": 111, "function": 2, "active": true}]}';
-            sql = "UPDATE teams SET team_members = '{\"members\": %s}' WHERE id=%d;" % (asc, id)
-            print(sql)
-            result = await self.pg.execute(sql)
+        stages = [(f"tm_{table}",
+                   "team_id int, user_id bigint, function int, active boolean",
+                   f"SELECT team_id, user_id, function, active FROM {table}"),
+                  ]
+        # FIXME: do we need join_request_notifications ?
+        functions = " ".join([f"WHEN {function.value} THEN '{function.name}'" for function in Teammemberfunctions])
+        sql = f"""UPDATE teams SET team_members = jsonb_build_object('members', s.members)
+            FROM (SELECT team_id, jsonb_agg(jsonb_build_object('user_id', user_id,
+                'function', CASE function {functions} END,
+                'active', CASE WHEN active THEN 'true' ELSE 'false' END)
+                ORDER BY user_id) AS members
+                FROM tm_{table} GROUP BY team_id) AS s
+            WHERE teams.id = s.team_id"""
+        await self.mergeStaged(inpg, stages, [sql])
 
         timer.stop()
         return True
 
+    async def mergeAuxTables(self,
+                             inuri: str,
+                             outuri: str,
+                             pool: DBPool = None,
+                             resume: bool = False,
+                             ):
+        """
+        Merge more tables from TM into the unified teams table.
+
+        Args:
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
+        """
+        await self.connect(outuri)
+        await self.connectPool(outuri, pool, resume)
+
+        inpg = PostgresClient()
+        await inpg.connect(inuri)
+
+        await self.mergeStep('team_members', self.mergeTeams, inpg)
+
 async def main():
     """This main function lets this class be run standalone by a bash script."""
     parser = argparse.ArgumentParser()
@@ -132,13 +144,9 @@ async def main():
         stream=sys.stdout,
     )
 
-    inpg = PostgresClient()
-    await inpg.connect(args.inuri)
-
     team = TeamsDB()
-    await team.connect(args.outuri)
-    await team.mergeTeams(inpg)
-    
+    await team.mergeAuxTables(args.inuri, args.outuri)
+
     # # user.resetSequence()
     # all = team.getAll()
     # # Don't pass id, let postgres auto increment
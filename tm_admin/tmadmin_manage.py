@@ -30,11 +30,17 @@ from tm_admin.proto import ProtoBuf
 from tm_admin.yamlfile import YamlFile
 from tm_admin.generator import Generator
 from tm_admin.tmdb import TMImport
+from tm_admin.dbpool import DBPool
+from tm_admin.sync import TMSync
+from tm_admin.scheduler import Scheduler
+from tm_admin.metrics import progress
+from tm_admin.__version__ import __version__
 from tm_admin.users.users import UsersDB
 from tm_admin.projects.projects import ProjectsDB
 from tm_admin.tasks.tasks import TasksDB
-from tqdm import tqdm
-import tqdm.asyncio
+from tm_admin.campaigns.campaigns import CampaignsDB
+from tm_admin.organizations.organizations import OrganizationsDB
+from tm_admin.teams.teams import TeamsDB
 import asyncio
 
 # Instantiate logger
@@ -43,6 +49,18 @@ log = logging.getLogger(__name__)
 import tm_admin as tma
 rootdir = tma.__path__[0]
 
+# The TM Admin tables that have to be imported before the aux tables
+# can be merged into a table. The merges read the aux tables from TM,
+# so only need the table they update.
+mergedepends = {
+    'users': ['users'],
+    'projects': ['projects'],
+    'tasks': ['tasks'],
+    'campaigns': ['campaigns'],
+    'organizations': ['organizations'],
+    'teams': ['teams'],
+}
+
 class TmAdminManage(object):
     def __init__(self,
                  dburi: str = "localhost/tm_admin"
@@ -51,6 +69,8 @@ class TmAdminManage(object):
         self.columns = {'drop': list(), 'add': list()}
         self.dburi = dict()
         self.pg = None
+        # The schedule of the last import or merge, for the summary
+        self.scheduler = None
 
     async def connect(self,
                 inuri: str,
@@ -121,10 +141,129 @@ class TmAdminManage(object):
         for sql in progs:
             log.info(f"Updating table {sql} in database")
 
+    async def importTable(self,
+                table: str,
+                inuri: str,
+                outuri: str,
+                pool: DBPool,
+                batch: int = 10000,
+                insert: bool = False,
+                resume: bool = False,
+                server: bool = False,
+                readers: int = 1,
+                columnar: bool = False,
+                ):
+        """
+        Import the data from a TM table into TM Admin one. Each table
+        gets it's own importer, since several may run at the same time.
+
+        Args:
+            table (str): The table to import data from and to
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            batch (int): The number of records to read at a time
+            insert (bool): Use INSERT instead of COPY, for debugging
+            resume (bool): Skip the data already imported by a previous run
+            server (bool): Import inside postgres using postgres_fdw
+            readers (int): The number of key ranges of a table to read at once
+            columnar (bool): Keep each batch as columns instead of records
+        """
+        log.info(f"Importing the '{table}' table")
+        tmi = TMImport(batch, server, readers, columnar)
+        await tmi.connect(inuri, outuri, pool)
+        # Each table has it's own config file
+        await tmi.loadConfig(table)
+        await tmi.importDB(table, insert, resume)
+
+    async def mergeTable(self,
+                table: str,
+                inuri: str,
+                outuri: str,
+                pool: DBPool,
+                resume: bool = False,
+                ):
+        """
+        Merge the aux tables from TM into a TM Admin table.
+
+        Args:
+            table (str): The table to merge data into
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
+        """
+        log.info(f"Merging into the '{table}' table")
+        # Instantiate the class
+        obj = eval(f"{table.capitalize()}DB")
+        func = obj()
+        await func.mergeAuxTables(inuri, outuri, pool, resume)
+
+    def scheduleImports(self,
+                scheduler: Scheduler,
+                tables: list,
+                inuri: str,
+                outuri: str,
+                pool: DBPool,
+                batch: int = 10000,
+                insert: bool = False,
+                resume: bool = False,
+                server: bool = False,
+                readers: int = 1,
+                columnar: bool = False,
+                ):
+        """
+        Add the import of the TM tables to the schedule. The primary
+        tables don't depend on each other, so can all run at once.
+
+        Args:
+            scheduler (Scheduler): The schedule to add to
+            tables (list): The tables to import data from and to
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            batch (int): The number of records to read at a time
+            insert (bool): Use INSERT instead of COPY, for debugging
+            resume (bool): Skip the data already imported by a previous run
+            server (bool): Import inside postgres using postgres_fdw
+            readers (int): The number of key ranges of a table to read at once
+            columnar (bool): Keep each batch as columns instead of records
+        """
+        for table in tables:
+            scheduler.add(f"import:{table}", self.importTable, table, inuri, outuri, pool, batch, insert, resume, server, readers, columnar)
+
+    def scheduleMerges(self,
+                scheduler: Scheduler,
+                tables: list,
+                inuri: str,
+                outuri: str,
+                pool: DBPool,
+                resume: bool = False,
+                ):
+        """
+        Add the merge of the aux tables to the schedule. These update
+        the records in the primary tables, so have to wait for them
+        to be imported first.
+
+        Args:
+            scheduler (Scheduler): The schedule to add to
+            tables (list): The tables to merge data into
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
+        """
+        for table in tables:
+            depends = [f"import:{depend}" for depend in mergedepends.get(table, [table])]
+            scheduler.add(f"merge:{table}", self.mergeTable, table, inuri, outuri, pool, resume, depends=depends)
+
     async def mergeAuxTables(self,
                 tables: list,
                 inuri: str,
                 outuri: str,
+                pool: DBPool = None,
+                resume: bool = False,
+                jobs: int = 4,
                 ):
         """
         Merge the data from a TM table into TM Admin one. These are tables
@@ -134,32 +273,117 @@ class TmAdminManage(object):
             tables (list): The tables to import data from and to
             inuri (str): The input database
             outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
+            jobs (int): The number of tables to merge at once
         """
-        # This requires all the generated files have been installed
-        for table in tables:
-            log.info(f"Importing the '{table}' table")
-            # Instantiate the class
-            obj = eval(f"{table.capitalize()}DB")
-            func = obj()
-            await func.mergeAuxTables(inuri, outuri)
+        scheduler = Scheduler(jobs)
+        self.scheduler = scheduler
+        self.scheduleMerges(scheduler, tables, inuri, outuri, pool, resume)
+        await scheduler.run()
+        print(scheduler.summary())
 
     async def importTables(self,
                 tables: list,
-                tmi: TMImport,
+                inuri: str,
+                outuri: str,
+                pool: DBPool = None,
+                batch: int = 10000,
+                insert: bool = False,
+                resume: bool = False,
+                jobs: int = 4,
+                server: bool = False,
+                readers: int = 1,
+                columnar: bool = False,
                 ):
         """
         Import the data from a TM table into TM Admin one.
 
         Args:
             tables (list): The tables to import data from and to
-            tmi (TMImport): An instantiation of the class that imports data
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            batch (int): The number of records to read at a time
+            insert (bool): Use INSERT instead of COPY, for debugging
+            resume (bool): Skip the data already imported by a previous run
+            jobs (int): The number of tables to import at once
+            server (bool): Import inside postgres using postgres_fdw
+            readers (int): The number of key ranges of a table to read at once
+            columnar (bool): Keep each batch as columns instead of records
         """
-        # This requires all the generated files have been installed
-        for table in tables:
-            log.info(f"Importing the '{table}' table")
-            # Each table has it's own config file
-            await tmi.loadConfig(table)
-            await tmi.importDB(table)
+        scheduler = Scheduler(jobs)
+        self.scheduler = scheduler
+        self.scheduleImports(scheduler, tables, inuri, outuri, pool, batch, insert, resume, server, readers, columnar)
+        await scheduler.run()
+        print(scheduler.summary())
+
+    async def importAll(self,
+                tables: list,
+                aux: list,
+                inuri: str,
+                outuri: str,
+                pool: DBPool = None,
+                batch: int = 10000,
+                insert: bool = False,
+                resume: bool = False,
+                jobs: int = 4,
+                server: bool = False,
+                readers: int = 1,
+                columnar: bool = False,
+                ):
+        """
+        Import the primary tables, and merge the aux tables into them.
+        Each merge starts as soon as the tables it needs are imported,
+        instead of waiting for all of the imports to finish.
+
+        Args:
+            tables (list): The tables to import data from and to
+            aux (list): The tables to merge data into
+            inuri (str): The input database
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            batch (int): The number of records to read at a time
+            insert (bool): Use INSERT instead of COPY, for debugging
+            resume (bool): Skip the data already done by a previous run
+            jobs (int): The number of tables to process at once
+            server (bool): Import inside postgres using postgres_fdw
+            readers (int): The number of key ranges of a table to read at once
+            columnar (bool): Keep each batch as columns instead of records
+        """
+        scheduler = Scheduler(jobs)
+        self.scheduler = scheduler
+        self.scheduleImports(scheduler, tables, inuri, outuri, pool, batch, insert, resume, server, readers, columnar)
+        self.scheduleMerges(scheduler, aux, inuri, outuri, pool, resume)
+        await scheduler.run()
+        print(scheduler.summary())
+
+    def writeSummary(self,
+                filespec: str,
+                cmd: str,
+                ):
+        """
+        Write the progress of all the tables, and the timing of the
+        jobs that processed them, to a JSON file. This can be compared
+        between runs to catch anything that got slower.
+
+        Args:
+            filespec (str): The file to write
+            cmd (str): The command that was run
+        """
+        jobs = dict()
+        path = list()
+        length = 0.0
+        if self.scheduler is not None:
+            for name, (begin, elapsed) in self.scheduler.timing.items():
+                jobs[name] = {"start": round(begin, 3), "seconds": round(elapsed, 3)}
+            path, length = self.scheduler.criticalPath()
+        progress.write(filespec,
+                       command=cmd,
+                       version=__version__,
+                       jobs=jobs,
+                       critical={"path": path, "seconds": round(length, 3)},
+                       )
 
     async def createDB(self,
                 files: list,
@@ -281,9 +505,18 @@ async def main():
 
         # Import the data for just the users table
         tmadmin_manage.py -v -c import users
+
+        # Merge the aux tables into the primary tables
+        tmadmin_manage.py -v -c merge
+
+        # Import and merge everything, running tables in parallel
+        tmadmin_manage.py -v -c all -j 4
+
+        # Pull in what has changed in TM since the import, or the last sync
+        tmadmin_manage.py -v -c sync
         """,
     )
-    choices = ['generate', 'create', 'import', 'merge', 'update', 'migrate']
+    choices = ['generate', 'create', 'import', 'merge', 'all', 'sync', 'update', 'migrate']
     parser.add_argument("-v", "--verbose", nargs="?", const="0",
                         help="verbose output")
     # parser.add_argument("-d", "--diff", help="SQL file diff for migrations")
@@ -294,6 +527,26 @@ async def main():
                         help="Output Database URI")
     parser.add_argument("-c", "--cmd", choices=choices, default='generate',
                             help="Command")
+    parser.add_argument("-n", "--insert", action="store_true",
+                        help="Import using INSERT instead of COPY, for debugging")
+    parser.add_argument("-b", "--batch", type=int, default=10000,
+                        help="The number of records to read at a time, 0 reads the entire table")
+    parser.add_argument("--minpool", type=int, default=2,
+                        help="The number of database connections to open at startup")
+    parser.add_argument("--maxpool", type=int, default=8,
+                        help="The maximum number of database connections used by the workers")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="The number of tables to import or merge at once")
+    parser.add_argument("-r", "--resume", action="store_true",
+                        help="Resume an import or merge that didn't finish")
+    parser.add_argument("--readers", type=int, default=4,
+                        help="The number of ranges of a big table to read at once, each with it's own connection to TM")
+    parser.add_argument("--columnar", action="store_true",
+                        help="Keep each batch as columns instead of records, which uses less memory")
+    parser.add_argument("--server", action="store_true",
+                        help="Import inside postgres using postgres_fdw, if it can reach the TM database")
+    parser.add_argument("-s", "--summary", default="tmadmin-summary.json",
+                        help="The JSON file for the progress and timing summary")
     # parser.add_argument("-t", "--table", choices=choices, help="The table to import")
     args, known = parser.parse_known_args()
 
@@ -319,6 +572,10 @@ async def main():
     # The base class that does all the work
     tm = TmAdminManage()
     await tm.connect(args.outuri)
+
+    # All the worker threads share one pool of database connections
+    pool = DBPool(args.minpool, args.maxpool)
+    await pool.connect(args.outuri)
     # tm.createDB()
 
     # This database tables stores the versions of the table schemas,
@@ -329,6 +586,9 @@ async def main():
     result = await tm.createTable(f"{rootdir}/types_tm.sql")
     await tm.pg.execute(result)
 
+    # Log the progress of all the tables every so often
+    reporter = asyncio.create_task(progress.report())
+
     # This class generates all the output files.
     if args.cmd == 'generate':
         gen = Generator()
@@ -366,21 +626,45 @@ async def main():
         # files = ['teams/team_members.sql']
         # files += known
         tmi = TMImport()
-        await tmi.connect(args.inuri, args.outuri)
+        await tmi.connect(args.inuri, args.outuri, pool)
         await tm.createDB(known, tmi)
     elif args.cmd == 'import':
-        tmi = TMImport()
-        await tmi.connect(args.inuri, args.outuri)
-        await tm.importTables(known, tmi)
+        # Save where TM is at now, so a later sync starts from here
+        sync = TMSync(args.batch)
+        await sync.connect(args.inuri, args.outuri, pool)
+        if not args.resume:
+            await sync.markTables(known)
+        await tm.importTables(known, args.inuri, args.outuri, pool, args.batch, args.insert, args.resume, args.jobs, args.server, args.readers, args.columnar)
     elif args.cmd == 'merge':
-        aux = ["projects", "users", "tasks"]
-        await tm.mergeAuxTables(aux, args.inuri, args.outuri)
+        aux = ["projects", "users", "tasks", "campaigns", "organizations", "teams"]
+        sync = TMSync(args.batch)
+        await sync.connect(args.inuri, args.outuri, pool)
+        if not args.resume:
+            await sync.markAuxTables(aux)
+        await tm.mergeAuxTables(aux, args.inuri, args.outuri, pool, args.resume, args.jobs)
+    elif args.cmd == 'all':
+        aux = [table for table in ["projects", "users", "tasks", "campaigns", "organizations", "teams"] if table in known]
+        sync = TMSync(args.batch)
+        await sync.connect(args.inuri, args.outuri, pool)
+        if not args.resume:
+            await sync.markTables(known)
+            await sync.markAuxTables(aux)
+        await tm.importAll(known, aux, args.inuri, args.outuri, pool, args.batch, args.insert, args.resume, args.jobs, args.server, args.readers, args.columnar)
+    elif args.cmd == 'sync':
+        sync = TMSync(args.batch)
+        await sync.connect(args.inuri, args.outuri, pool)
+        await sync.syncTables(known)
     elif args.cmd == 'update':
         tm.updateDB(known)
     elif args.cmd == 'migrate':
         # tm.migrateDB(known)
         pass
 
+    reporter.cancel()
+    if args.cmd in ['import', 'merge', 'all', 'sync']:
+        tm.writeSummary(args.summary, args.cmd)
+
+    await pool.close()
     # tm.dump()
 
 if __name__ == "__main__":
@@ -42,8 +42,6 @@ from tm_admin.pgsupport import PGSupport
 import typing
 import tm_admin
 import re
-from tqdm import tqdm
-import tqdm.asyncio
 from codetiming import Timer
 import asyncio
 from http import HTTPStatus
@@ -131,7 +129,7 @@ class UsersAPI(PGSupport):
         """
         result = await self.getColumns(['role'], {"id": user_id})
 
-        return eval(f"Roles.{result[0]['role']}")
+        return Roles(result[0]['role'])
 
     async def getBlocked(self,
                   user_id: int,
@@ -147,7 +145,7 @@ class UsersAPI(PGSupport):
         """
         result = await self.getColumns(['role'], {"id": user_id})
 
-        role = eval(f"Roles.{result[0]['role']}")
+        role = Roles(result[0]['role'])
         if role == Roles.READ_ONLY:
             return True
         else:
@@ -27,79 +27,24 @@ import argparse
 import logging
 import sys
 import os
+import json
 from sys import argv
 from datetime import datetime
 from dateutil.parser import parse
 import tm_admin.types_tm
+from tm_admin.schema import getSchema
 from tm_admin.types_tm import Roles, Mappinglevel, Teammemberfunctions
 import concurrent.futures
-from cpuinfo import get_cpu_info
 from tm_admin.users.users_class import UsersTable
 from osm_rawdata.pgasync import PostgresClient
-from tqdm import tqdm
-import tqdm.asyncio
 import asyncio
 from codetiming import Timer
 from tm_admin.dbsupport import DBSupport
+from tm_admin.dbpool import DBPool
 
 # Instantiate logger
 log = logging.getLogger(__name__)
 
-# The number of threads is based on the CPU cores
-info = get_cpu_info()
-cores = info["count"] * 2
-
-async def licensesThread(
-        licenses: list,
-        db: PostgresClient,
-        ):
-    pbar = tqdm.tqdm(licenses)
-    for record in pbar:
-        sql = f" UPDATE users SET licenses = licenses||ARRAY[{record[1]}] WHERE id={record[0]}"
-        # print(sql)
-        result = await db.execute(sql)
-
-    return True
-
-async def interestsThread(
-    interests: list,
-    db: PostgresClient,
-):
-    """Thread to handle importing
-
-    Args:
-        interests (list): The list of records to import
-        db (PostgresClient): A database connection
-    """
-    pbar = tqdm.tqdm(interests)
-    for record in pbar:
-        for id, array in record.items():
-            sql = f" UPDATE users SET interests = interests||ARRAY{array} WHERE id={id}"
-            # print(sql)
-            result = await db.execute(sql)
-
-    return True
-
-async def favoritesThread(
-    favorites: list,
-    db: PostgresClient,
-):
-    """Thread to handle importing favorites
-
-    Args:
-        favorites (list): The list of records to import
-        db (PostgresClient): A database connection
-    """
-    data = dict()
-    pbar = tqdm(favorites)
-    for record in pbar:
-        for id, array in record.items():
-            sql = f" UPDATE users SET favorite_projects = ARRAY{projects} WHERE id={uid}"
-            # print(sql)
-            result = await db.execute(f"{sql};")
-
-    return True
-
 class UsersDB(DBSupport):
     def __init__(self,
                  dburi: str = "localhost/tm_admin",
@@ -115,7 +60,7 @@ class UsersDB(DBSupport):
         """
         self.pg = None
         self.profile = UsersTable()
-        self.types = dir(tm_admin.types_tm)
+        self.types = getSchema().enums
         # super().__init__('users', dburi)
         super().__init__('users')
 
@@ -144,7 +89,7 @@ class UsersDB(DBSupport):
         # print(sql)
         result = await inpg.execute(sql)
         admins = dict()
-        for entry in eval(result[0]['json_agg']):
+        for entry in json.loads(result[0]['json_agg']):
             sql = f"UPDATE users SET role = 'PROJECT_MANAGER' WHERE id={entry['id']}"
             result = await outpg.execute(sql)
 
@@ -153,7 +98,7 @@ class UsersDB(DBSupport):
         # print(sql)
         result = await inpg.execute(sql)
         admins = dict()
-        for entry in eval(result[0]['json_agg']):
+        for entry in json.loads(result[0]['json_agg']):
             sql = f"UPDATE users SET role = 'READ_ONLY' WHERE id={entry['id']}"
             result = await outpg.execute(sql)
 
@@ -161,189 +106,112 @@ class UsersDB(DBSupport):
                              inpg: PostgresClient,
                              ):
         """
-        Merge the user_interests table from the Tasking Manager
+        Merge the user_interests table from the Tasking Manager into
+        the interests array in the users table. The TM table is staged
+        in TM Admin, and then all the users are updated at once.
 
         Args:
             inpg (PostgresClient): The input database
         """
         table = 'user_interests'
-        timer = Timer(initial_text="Merging user_interests table...",
-                      text="merging liceneses table took {seconds:.0f}s",
+        timer = Timer(initial_text=f"Merging {table} table...",
+                      text="merging table took {seconds:.0f}s",
                       logger=log.debug,
                     )
-        log.info(f"Merging interests table...")
+        log.info(f"Merging {table} table...")
         timer.start()
-        sql = "SELECT * FROM user_interests ORDER BY user_id"
-        result = await inpg.execute(sql)
-
-        # FIXME: this SQL turns out to be painfully slow, and we can create the array
-        # in python faster.
-        # await self.copyTable(table, remote)
-        # await self.renameTable(table)
-        # sql = f"SELECT row_to_json({table}) as row FROM {table}"
-        # Not all records in this table have data
-        # sql = f"SELECT u.user_id,ARRAY(SELECT ARRAY(SELECT c.interest_id FROM {table} c WHERE c.user_id = u.user_id)) AS user_id FROM {table} u;"
-        data = list()
-        entry = dict()
-        prev = None
-        # Restructure the data into a list, so we can more easily chop the data
-        # into multiple smaller pieces, one for each thread.
-        for record in result:
-            if prev == record['user_id']:
-                entry[record['user_id']].append(record['interest_id'])
-            else:
-                if len(entry) != 0:
-                    data.append(entry)
-                prev = record['user_id']
-                entry = {record['user_id']: [record['interest_id']]}
+        stages = [(f"tm_{table}",
+                   "user_id bigint, interest_id int",
+                   f"SELECT user_id, interest_id FROM {table}"),
+                  ]
+        sql = f"""UPDATE users SET interests = s.interests
+            FROM (SELECT user_id, array_agg(interest_id ORDER BY interest_id) AS interests
+                FROM tm_{table} GROUP BY user_id) AS s
+            WHERE users.id = s.user_id"""
+        await self.mergeStaged(inpg, stages, [sql])
         timer.stop()
 
-        # await remote.pg.close()
-        #pg = PostgresClient()
-        entries = len(data)
-        chunk = round(entries / cores)
-
-        start = 0
-        async with asyncio.TaskGroup() as tg:
-            for block in range(0, entries, chunk):
-                # for index in range(0, cores):
-                outpg = PostgresClient()
-                await outpg.connect('localhost/tm_admin')
-                log.debug(f"Dispatching thread {block}:{block + chunk}")
-                # await interestsThread(data, outpg)
-                task = tg.create_task(interestsThread(data[block:block + chunk], outpg))
-        
         return True
 
     async def mergeLicenses(self,
                              inpg: PostgresClient,
                              ):
         """
-        Merge data from the TM user_licenses table into TM Admin. The
-        fastest way to do a bulk update of a table is by copying the
-        remote database table into the local database, and then merging
-        into a new temporary table and then renaming it.
+        Merge data from the TM user_licenses table into the licenses
+        array in the users table. The TM table is staged in TM Admin,
+        and then all the users are updated at once.
 
         Args:
             inpg (PostgresClient): The input database
         """
         table = 'user_licenses'
-        # log.info(f"Merging licenses table...")
-        timer = Timer(initial_text="Merging user_licenses table...",
-                      text="merging user_liceneses table took {seconds:.0f}s",
+        timer = Timer(initial_text=f"Merging {table} table...",
+                      text="merging table took {seconds:.0f}s",
                       logger=log.debug,
                     )
+        log.info(f"Merging {table} table...")
         timer.start()
-        sql = "SELECT * FROM user_licenses ORDER BY user"
-        data = await inpg.execute(sql)
-
-        entries = len(data)
-        chunk = round(entries / cores)
-
-        start = 0
-        async with asyncio.TaskGroup() as tg:
-            for block in range(0, entries, chunk):
-                # for index in range(0, cores):
-                outpg = PostgresClient()
-                await outpg.connect('localhost/tm_admin')
-                log.debug(f"Dispatching thread {block}:{block + chunk}")
-                # await licensesThread(data, outpg)
-                task = tg.create_task(licensesThread(data[block:block + chunk], outpg))
-
-        # self.columns = await inpg.getColumns(table)
-        # print(f"COLUMNS: {self.columns}")
-
-        # await self.copyTable(table, self.pg)
-        # # log.warning(f"Merging tables can take considerable time...")
-
-        # # cleanup old temporary tables
-        # drop = ["DROP TABLE IF EXISTS users_bak",
-        #         "DROP TABLE IF EXISTS foo"]
-        # # result = await pg.pg.executemany(drop)
-        # sql = f"DROP TABLE IF EXISTS users_bak"
-        # result = await self.pg.execute(sql)
-        # sql = f"DROP TABLE IF EXISTS user_licenses"
-        # result = await self.pg.execute(sql)
-        # sql = f"DROP TABLE IF EXISTS new_users"
-        # result = await self.pg.execute(sql)
-
-        # # We need to use DBLINK
-        # sql = f"CREATE EXTENSION IF NOT EXISTS dblink;"
-        # data = await self.pg.execute(sql)
-
-        # dbuser = self.pg.dburi["dbuser"]
-        # dbpass = self.pg.dburi["dbpass"]
-        # sql = f"CREATE SERVER IF NOT EXISTS pg_rep_db FOREIGN DATA WRAPPER dblink_fdw  OPTIONS (dbname 'tm4');"
-        # data = await self.pg.execute(sql)
-
-        # sql = f"CREATE USER MAPPING IF NOT EXISTS FOR {dbuser} SERVER pg_rep_db OPTIONS ( user '{dbuser}', password '{dbpass}');"
-        # result = await self.pg.execute(sql)
-
-        # # Copy table from remote database so JOIN is faster when it's in the
-        # # same database
-        # log.warning(f"Copying a remote table is slow, but faster than remote access......")
-        # # sql = f"SELECT * INTO user_licenses FROM dblink('pg_rep_db','SELECT * FROM user_licenses') AS user_licenses(user_id bigint, license int)"
-        # # print(pg.dburi)
-        # # print(sql)
-        # # result = await pg.execute(sql)
-
-        # # JOINing into a new table is much faster than doing an UPDATE
-        # sql = f"SELECT users.*,ARRAY[user_licenses.license] INTO new_users FROM users JOIN user_licenses ON users.id=user_licenses.user_id"
-        # result = await self.pg.execute(sql)
-
-        # # self.renameTable(table, pg)
-        # # sql = f"ALTER TABLE users RENAME TO users_bak;"
-        # # result = await pg.execute(sql)
-        # # sql = f"ALTER TABLE new_users RENAME TO users;"
-        # # result = await pg.execute(sql)
-        # # sql = f"DROP TABLE IF EXISTS user_licenses"
-        # # result = await pg.execute(sql)
+        stages = [(f"tm_{table}",
+                   "user_id bigint, license int",
+                   f'SELECT "user", license FROM {table}'),
+                  ]
+        sql = f"""UPDATE users SET licenses = s.licenses
+            FROM (SELECT user_id, array_agg(license ORDER BY license) AS licenses
+                FROM tm_{table} GROUP BY user_id) AS s
+            WHERE users.id = s.user_id"""
+        await self.mergeStaged(inpg, stages, [sql])
         timer.stop()
 
+        return True
+
     async def mergeFavorites(self,
                             inpg: PostgresClient,
                             ):
+        """
+        Merge the TM project_favorites table into the favorite_projects
+        array in the users table. The TM table is staged in TM Admin,
+        and then all the users are updated at once.
+
+        Args:
+            inpg (PostgresClient): The input database
+        """
         table = 'project_favorites'
         timer = Timer(initial_text=f"Merging {table} table...",
                       text="merging table took {seconds:.0f}s",
                       logger=log.debug,
                     )
         log.info(f"Merging {table} table...")
-
         timer.start()
-        sql = f"SELECT u.user_id,(SELECT ARRAY(SELECT c.project_id FROM {table} c WHERE c.user_id = u.user_id)) AS projects FROM {table} u;"
-        #sql = f"SELECT row_to_json({table}) as row FROM {table} ORDER BY user_id"
-        print(sql)
-        result = await inpg.execute(sql)
-
-        entries = len(result)
-        log.debug(f"There are {entries} entries in {table}")
-        chunk = round(entries / cores)
-        pbar = tqdm.tqdm(result)
-
-        # This table has a small amount of data, so threading would be overkill.
-        for record in pbar:
-            uid = record.get('user_id')
-            array = record.get('projects')
-            sql = f" UPDATE users SET favorite_projects = ARRAY{array} WHERE id={uid}"
-            #print(sql)
-            result = await self.pg.execute(sql)
-
+        stages = [(f"tm_{table}",
+                   "user_id bigint, project_id int",
+                   f"SELECT user_id, project_id FROM {table}"),
+                  ]
+        sql = f"""UPDATE users SET favorite_projects = s.favorite_projects
+            FROM (SELECT user_id, array_agg(project_id ORDER BY project_id) AS favorite_projects
+                FROM tm_{table} GROUP BY user_id) AS s
+            WHERE users.id = s.user_id"""
+        await self.mergeStaged(inpg, stages, [sql])
         timer.stop()
+
         return True
 
     async def mergeAuxTables(self,
                              inuri: str,
                              outuri: str,
+                             pool: DBPool = None,
+                             resume: bool = False,
                              ):
         """
         Merge more tables from TM into the unified users table.
 
         Args:
             inuri (str): The input database
-            outuri (str): The output database        
+            outuri (str): The output database
+            pool (DBPool): The shared pool of connections to the output database
+            resume (bool): Skip the tables already merged by a previous run
         """
         await self.connect(outuri)
+        await self.connectPool(outuri, pool, resume)
 
         inpg = PostgresClient()
         await inpg.connect(inuri)
@@ -353,11 +221,11 @@ class UsersDB(DBSupport):
 
         await self.fixRoles(inpg, outpg)
 
-        await self.mergeFavorites(inpg)
+        await self.mergeStep('project_favorites', self.mergeFavorites, inpg)
 
-        await self.mergeInterests(inpg)
+        await self.mergeStep('user_interests', self.mergeInterests, inpg)
 
-        result = await self.mergeLicenses(inpg)
+        result = await self.mergeStep('user_licenses', self.mergeLicenses, inpg)
 
 async def main():
     """This main function lets this class be run standalone by a bash script."""